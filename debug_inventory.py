@@ -1,9 +1,7 @@
 import asyncio
-import json
 from inventory import InventoryManager
 
-# Mock DB
-class MockDB: pass
+TARGET = 'MTY62'
 
 async def debug_inv():
     # Helper to check ES market for Model Y
@@ -14,27 +12,26 @@ async def debug_inv():
         'zip': '28001' # Madrid
     }
     
-    inv = InventoryManager(MockDB())
+    inv = InventoryManager()
     print("Fetching inventory...")
     results = await inv.check_inventory(criteria)
     print(f"Found {len(results)} cars.")
     
     found_mty62 = False
+    test_criteria = {'options': [TARGET]}
     
     for i, car in enumerate(results):
-        opts = car.get('OptionCodeList', [])
-        vin = car.get('VIN')
+        vin = car.vin
         
-        # Check if MTY62 is present
-        has_mty62 = any('MTY62' in o for o in opts)
+        # Check if MTY62 is present (car.options is a frozenset of '$'-stripped codes)
+        has_mty62 = TARGET in car.options
         
         if has_mty62:
             found_mty62 = True
             print(f"\nExample MTY62 Car ({vin}):")
-            print(f"Options: {opts}")
+            print(f"Options: {sorted(car.options)}")
             
             # Test match logic
-            test_criteria = {'options': ['$MTY62']}
             matches = inv.find_matches([car], test_criteria)
             if matches:
                  print(" -> MATCHED with logic")
@@ -45,7 +42,7 @@ async def debug_inv():
         print("\nNo MTY62 cars found in current inventory sample.")
         # Print first car options just to see
         if results:
-            print(f"First Car Options: {results[0].get('OptionCodeList')}")
+            print(f"First Car Options: {sorted(results[0].options)}")
 
 if __name__ == "__main__":
     asyncio.run(debug_inv())
@@ -1,8 +1,10 @@
 import asyncio
+import hashlib
 import httpx
-import json
 import logging
+import orjson
 import os
+import random
 import sys
 
 # Configure logging
@@ -12,8 +14,22 @@ logger = logging.getLogger(__name__)
 # Constants
 MODELS = ['my', 'm3', 'ms', 'mx']
 MARKET = "ES"
+OUTPUT_FILE = "option_codes.json"
+# Upper bound on concurrent requests against tesla.com
+MAX_CONCURRENCY = 4
 
-async def fetch_inventory(model, market="ES"):
+# Transient statuses worth retrying (rate limit / gateway errors)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_ATTEMPTS = 5
+
+# Raw Tesla option group -> normalized category (anything else is "Other")
+GROUP_MAP = {}
+for k in ("PAINT", "Paint", "PAINT_COLOR"): GROUP_MAP[k] = "Paint"
+for k in ("WHEELS", "Wheels", "WHEEL_TYPE"): GROUP_MAP[k] = "Wheels"
+for k in ("INTERIOR", "Interior", "Reats_Seats", "REAR_SEATS", "INTERIOR_PACKAGE"): GROUP_MAP[k] = "Interior"
+for k in ("AUTOPILOT", "Autopilot", "AUTOPILOT_PACKAGE"): GROUP_MAP[k] = "Autopilot"
+
+async def fetch_inventory(client, model, market="ES"):
     url = "https://www.tesla.com/inventory/api/v4/inventory-results"
     
     query = {
@@ -58,17 +74,27 @@ async def fetch_inventory(model, market="ES"):
         "origin": "https://www.tesla.com"
     }
 
-    async with httpx.AsyncClient(timeout=10.0, http2=True) as client:
-        try:
-            logger.info(f"Fetching {model} in {market}...")
-            resp = await client.get(url, params={"query": json.dumps(query)}, headers=headers)
-            if resp.status_code != 200:
-                logger.error(f"Error {resp.status_code}: {resp.text[:200]}")
-                return None
-            return resp.json()
-        except Exception as e:
-            logger.error(f"Request failed: {e}")
+    try:
+        logger.info(f"Fetching {model} in {market}...")
+        params = {"query": orjson.dumps(query).decode()}
+        for attempt in range(MAX_ATTEMPTS):
+            resp = await client.get(url, params=params, headers=headers)
+            if resp.status_code not in RETRY_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                break
+            try:
+                delay = float(resp.headers.get("Retry-After", 2 ** attempt))
+            except ValueError:
+                delay = 2 ** attempt
+            delay += random.uniform(0, 0.25)
+            logger.warning(f"{resp.status_code} for {model}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        if resp.status_code != 200:
+            logger.error(f"Error {resp.status_code}: {resp.text[:200]}")
             return None
+        return orjson.loads(resp.content)
+    except Exception as e:
+        logger.error(f"Request failed: {e}")
+        return None
 
 def extract_options(data):
     if not data: return {}
@@ -90,26 +116,16 @@ def extract_options(data):
             if not code or not name: continue
             
             # Normalize group name
-            if group in ["PAINT", "Paint", "PAINT_COLOR"]: group = "Paint"
-            elif group in ["WHEELS", "Wheels", "WHEEL_TYPE"]: group = "Wheels"
-            elif group in ["INTERIOR", "Interior", "Reats_Seats", "REAR_SEATS", "INTERIOR_PACKAGE"]: group = "Interior"
-            elif group in ["AUTOPILOT", "Autopilot", "AUTOPILOT_PACKAGE"]: group = "Autopilot"
-            else: group = "Other"
-            
-            if group not in extracted: extracted[group] = {}
-            extracted[group][code] = name
+            group = GROUP_MAP.get(group, "Other")
+            extracted.setdefault(group, {})[code] = name
             
     return extracted
 
 def load_existing_options():
     try:
-        if os.path.exists("option_codes.py"):
-            with open("option_codes.py", "r") as f:
-                content = f.read()
-            
-            scope = {}
-            exec(content, scope)
-            data = scope.get("OPTION_CODES_DATA", {})
+        if os.path.exists(OUTPUT_FILE):
+            with open(OUTPUT_FILE, "rb") as f:
+                data = orjson.loads(f.read())
             # Verify structure: if flat (old format), migrate it or just return specific format
             # Old format: {'Paint': {...}, ...} (root is categories)
             # New format: {'my': {'Paint': ...}, ...} (root is models)
@@ -128,8 +144,9 @@ def load_existing_options():
         logger.error(f"Failed to load existing options from file: {e}")
     return {}
 
-def merge_options_for_model(existing_root, model, new_model_data):
+def merge_options_for_model(existing_root, model, new_model_data, dirty=None):
     # existing_root is {'my': {...}, 'm3': {...}}
+    # dirty (optional set) collects (model, cat) pairs that gained codes and need re-sorting
     
     if model not in existing_root:
         existing_root[model] = {}
@@ -137,32 +154,61 @@ def merge_options_for_model(existing_root, model, new_model_data):
     for cat, items in new_model_data.items():
         if cat not in existing_root[model]:
             existing_root[model][cat] = {}
+        before = len(existing_root[model][cat])
         existing_root[model][cat].update(items)
+        if dirty is not None and len(existing_root[model][cat]) != before:
+            dirty.add((model, cat))
         
     return existing_root
 
 async def main():
     final_options = load_existing_options()
-    
-    for model in MODELS:
-        data = await fetch_inventory(model, MARKET)
+
+    # Fetch all models concurrently over one shared client, bounded by a semaphore
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def fetch_bounded(client, model):
+        async with sem:
+            return await fetch_inventory(client, model, MARKET)
+
+    limits = httpx.Limits(max_keepalive_connections=8)
+    async with httpx.AsyncClient(timeout=10.0, http2=True, limits=limits) as client:
+        results = await asyncio.gather(*(fetch_bounded(client, m) for m in MODELS))
+
+    dirty = set()
+    for model, data in zip(MODELS, results):
         if data:
             new_opts = extract_options(data)
             logger.info(f"Found {sum(len(v) for v in new_opts.values())} options for {model}.")
-            final_options = merge_options_for_model(final_options, model, new_opts)
-            await asyncio.sleep(1)
-
-    # Sort
-    sorted_root = {}
-    for model, cats in final_options.items():
-        sorted_root[model] = {k: dict(sorted(v.items())) for k, v in sorted(cats.items())}
-
-    with open("option_codes.py", "w") as f:
-        f.write("# Auto-generated Option Codes\n# Structure: Model -> Category -> Code: Name\n\n")
-        f.write("OPTION_CODES_DATA = ")
-        json.dump(sorted_root, f, indent=2, ensure_ascii=False)
-        f.write("\n")
-    logger.info("Saved to option_codes.py")
+            final_options = merge_options_for_model(final_options, model, new_opts, dirty)
+
+    # Sort: the loaded file is already sorted, so only re-sort what gained codes
+    for model, cat in dirty:
+        cats = final_options[model]
+        cats[cat] = dict(sorted(cats[cat].items()))
+    for model in {model for model, _ in dirty}:
+        final_options[model] = dict(sorted(final_options[model].items()))
+
+    # Byte-for-byte the same layout as json.dumps(indent=2, ensure_ascii=False) + "\n"
+    blob = orjson.dumps(final_options, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
+    new_hash = hashlib.blake2b(blob, digest_size=16).digest()
+    if os.path.exists(OUTPUT_FILE):
+        with open(OUTPUT_FILE, "rb") as f:
+            if hashlib.blake2b(f.read(), digest_size=16).digest() == new_hash:
+                logger.info(f"No new options, {OUTPUT_FILE} unchanged")
+                return
+
+    # Write-and-rename so readers never see a partial file
+    tmp = OUTPUT_FILE + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(blob)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    os.replace(tmp, OUTPUT_FILE)
+    logger.info(f"Saved to {OUTPUT_FILE}")
 
 if __name__ == "__main__":
     asyncio.run(main())
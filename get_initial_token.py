@@ -1,14 +1,15 @@
 import hashlib
 import base64
+import json
 import os
-import random
-import string
-import httpx
-from urllib.parse import urlparse, parse_qs
+import secrets
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse, parse_qs, urlencode
 
 def generate_code_verifier_and_challenge():
-    # standard PKCE verifier generation
-    code_verifier = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(86))
+    # standard PKCE verifier generation (CSPRNG, 86 url-safe chars)
+    code_verifier = secrets.token_urlsafe(64)[:86]
     code_challenge = hashlib.sha256(code_verifier.encode('utf-8')).digest()
     code_challenge = base64.urlsafe_b64encode(code_challenge).decode('utf-8').rstrip('=')
     return code_verifier, code_challenge
@@ -26,10 +27,10 @@ def get_auth_code(code_challenge):
     }
     
     # Build complete URL
-    req = httpx.Request("GET", base_url, params=params)
+    auth_url = f"{base_url}?{urlencode(params)}"
     print("\n--- Step 1: Login ---")
     print("1. Open this URL in your browser:")
-    print(f"\n{req.url}\n")
+    print(f"\n{auth_url}\n")
     print("2. Log in with your Tesla account.")
     print("3. You will be redirected to a 'Page Not Found' (https://auth.tesla.com/void/callback...).")
     print("4. Copy the full URL from your browser address bar and paste it below.")
@@ -58,13 +59,16 @@ def exchange_code_for_tokens(auth_code, code_verifier):
     }
     
     print("\n--- Step 2: Exchanging Code for Tokens ---")
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+    )
     try:
-        with httpx.Client() as client:
-            response = client.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPStatusError as e:
-        print(f"HTTP Error exchanging tokens: {e.response.text}")
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        print(f"HTTP Error exchanging tokens: {e.read().decode('utf-8', 'replace')}")
         exit(1)
     except Exception as e:
         print(f"Error exchanging tokens: {e}")
@@ -1,13 +1,17 @@
 import os
 import logging
-import json
 import httpx
+import orjson
 import asyncio
-from datetime import datetime
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
-from option_codes import OPTION_CODES_DATA
+from option_codes import OPTION_CODES_DATA, CODE_TO_CATEGORY
 
 # Flatten for lookup (code -> name)
 OPTION_CODES = {}
@@ -15,40 +19,157 @@ for model, cats in OPTION_CODES_DATA.items():
     for category, items in cats.items():
         OPTION_CODES.update(items)
 
+INVENTORY_URL = "https://www.tesla.com/inventory/api/v4/inventory-results"
+
+# Transient statuses worth retrying (rate limit / gateway errors)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_ATTEMPTS = 5
+
+def retry_delay(resp, attempt):
+    """Seconds to wait before the next attempt: Retry-After if given, else exponential backoff, plus jitter."""
+    try:
+        delay = float(resp.headers.get('Retry-After', 2 ** attempt))
+    except ValueError:  # HTTP-date form
+        delay = 2 ** attempt
+    return delay + random.uniform(0, 0.25)
+
+def option_set(car):
+    """Return a raw result's option codes as a set, without the '$' prefix."""
+    car_options = car.get('OptionCodeMap') or car.get('OptionCodeList') or ()
+    # Handle parsing of OptionCodeList (can be string or list)
+    if isinstance(car_options, str):
+        car_options = car_options.split(',')
+    return frozenset(opt.lstrip('$') for opt in car_options)
+
+OR_CATEGORIES = frozenset({'Paint', 'Wheels'})
+
+def option_group(code, model):
+    """
+    OR-group a (normalized) criterion code belongs to, or None if it must be present.
+    Trims are filed under "Other" in the option data, so they keep the MT prefix rule;
+    codes missing from the model's data fall back to the P*/W* prefixes.
+    """
+    if code.startswith('MT'):
+        return 'Trim'
+    category = CODE_TO_CATEGORY.get(model, {}).get(code)
+    if category is not None:
+        return category if category in OR_CATEGORIES else None
+    if code.startswith('P'):
+        return 'Paint'
+    if code.startswith('W'):
+        return 'Wheels'
+    return None
+
+@lru_cache(maxsize=256)
+def group_criteria(codes, model):
+    """
+    Split a frozenset of criterion codes for `model` into (AND codes, tuple of OR groups).
+    Codes in the same OR category (trim, paint, wheels) need ANY match, everything else
+    is AND. Cached since a watch's criteria are the same on every check.
+    """
+    or_groups = {}
+    req_others = set()
+    for opt in codes:
+        group = option_group(opt, model)
+        if group:
+            or_groups.setdefault(group, set()).add(opt)
+        else:
+            req_others.add(opt)
+    return frozenset(req_others), tuple(frozenset(g) for g in or_groups.values())
+
+@dataclass(slots=True, frozen=True)
+class Car:
+    """Inventory result reduced to what matching and notifications need."""
+    vin: str
+    price: float
+    trim: str
+    color: str
+    city: str
+    currency: str
+    market: str
+    is_demo: bool
+    options: frozenset
+    model: str
+    language: str
+    odometer: object
+    odometer_type: str
+
+    @classmethod
+    def from_result(cls, car):
+        paint_data = car.get('PAINT')
+        return cls(
+            vin=car.get('VIN'),
+            price=car.get('OnTheRoadPrice') or car.get('Price') or float('inf'),
+            trim=car.get('TrimName', 'Unknown Trim'),
+            color=paint_data[0] if isinstance(paint_data, list) and paint_data else 'Unknown Color',
+            city=car.get('City', 'Unknown Location'),
+            currency=car.get('CurrencyCode', 'EUR'),
+            market=car.get('Market', 'ES'),
+            is_demo=car.get('IsDemo', False),
+            options=option_set(car),
+            model=car.get('Model', 'Unknown Model'),
+            language=car.get('Language', 'es'),
+            odometer=car.get('Odometer', 'Unknown Odometer'),
+            odometer_type=car.get('OdometerType', 'Unknown Odometer Type'),
+        )
+
+class _CacheEntry:
+    __slots__ = ('ts', 'results')
+
+    def __init__(self, ts, results):
+        self.ts = ts
+        self.results = results
+
 class InventoryManager:
-    def __init__(self, db):
+    def __init__(self, db=None):
         self.db = db
-        # Cache results to avoid spamming Tesla: { "ES_my_new_Price": { "timestamp": ..., "results": [...] } }
-        self.cache = {}
+        # Cache results to avoid spamming Tesla: { "ES_my_new_Price": _CacheEntry(ts, results) }
+        # Bounded LRU so a long-running bot doesn't accumulate every query it ever made
+        self.cache = OrderedDict()
         self.cache_ttl = 300  # 5 minutes
+        self.cache_size = 256
+        # In-flight fetches per cache key, so concurrent identical queries share one request
+        self._inflight = {}
+        # Serialized query params + headers per request fingerprint: { (market, model, ...): (params, headers) }
+        self._req_cache = {}
+        # Shared HTTP/2 client, opened lazily and reused across requests
+        self._client = None
+        self._client_lock = asyncio.Lock()
+        self.proxy = os.getenv('INVENTORY_PROXY')
+        # Cap concurrent requests to tesla.com so parallel watches don't trip rate limits
+        self._sem = asyncio.Semaphore(int(os.getenv('INVENTORY_MAX_CONCURRENCY', '4')))
 
-    async def check_inventory(self, criteria):
+    async def _get_client(self):
+        async with self._client_lock:
+            if self._client is None:
+                mounts = None
+                if self.proxy:
+                    mounts = {
+                        "https://": httpx.AsyncHTTPTransport(proxy=self.proxy, http2=True),
+                        "http://": httpx.AsyncHTTPTransport(proxy=self.proxy, http2=True),
+                    }
+                    logger.info(f"Using proxy: {self.proxy.split('@')[-1]}")
+                self._client = httpx.AsyncClient(timeout=20.0, http2=True, mounts=mounts)
+            return self._client
+
+    async def close(self):
+        """Close the shared HTTP client (call on application shutdown)."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _build_request_fingerprint(self, market, model, condition, zip_code, trim, lat, lng):
         """
-        Query Tesla Inventory API v4.
+        Return the (params, headers) for a query. They only depend on the arguments,
+        so each combination is built once and reused across retries and cache refreshes.
         """
-        market = criteria.get('market', 'ES')
-        model = criteria.get('model', 'my')
-        condition = criteria.get('condition', 'new')
-        # Default to Madrid if not specified
-        lat = criteria.get('lat', 40.4168)
-        lng = criteria.get('lng', -3.7038)
-        zip_code = criteria.get('zip', '28522')
+        key = (market, model, condition, zip_code, trim, lat, lng)
+        cached = self._req_cache.get(key)
+        if cached:
+            return cached
 
         # Build options filters (e.g. TRIM)
-        query_options = {}
-        if 'trim' in criteria:
-            query_options['TRIM'] = [criteria['trim']]
-
-        cache_key = f"{market}_{model}_{condition}_{criteria.get('trim','all')}"
-
-        # Check cache
-        if cache_key in self.cache:
-            entry = self.cache[cache_key]
-            if (datetime.now().timestamp() - entry['timestamp']) < self.cache_ttl:
-                logger.info(f"Using cached inventory for {cache_key}")
-                return entry['results']
-
-        url = "https://www.tesla.com/inventory/api/v4/inventory-results"
+        query_options = {'TRIM': [trim]} if trim else {}
 
         # Structure derived from user input
         query_payload = {
@@ -75,14 +196,12 @@ class InventoryManager:
             "version": "v2"
         }
 
-        params = {"query": json.dumps(query_payload)}
+        params = {"query": orjson.dumps(query_payload).decode()}
 
         # Construct Referer matching the working test script
         locale = "es_ES" if market == 'ES' else f"{market.lower()}_{market}"
-        referer = f"https://www.tesla.com/{locale}/inventory/{condition}/{model}?arrangeby=plh&zip={zip_code}&range=0"
-        if 'trim' in criteria:
-             referer = f"https://www.tesla.com/{locale}/inventory/{condition}/{model}?TRIM={criteria['trim']}&arrangeby=plh&zip={zip_code}&range=0"
-
+        trim_qs = f"TRIM={trim}&" if trim else ""
+        referer = f"https://www.tesla.com/{locale}/inventory/{condition}/{model}?{trim_qs}arrangeby=plh&zip={zip_code}&range=0"
 
         headers = {
             "authority": "www.tesla.com",
@@ -102,33 +221,73 @@ class InventoryManager:
             "origin": "https://www.tesla.com"
         }
 
+        self._req_cache[key] = (params, headers)
+        return params, headers
+
+    async def check_inventory(self, criteria):
+        """
+        Query Tesla Inventory API v4.
+        """
+        market = criteria.get('market', 'ES')
+        model = criteria.get('model', 'my')
+        condition = criteria.get('condition', 'new')
+        # Default to Madrid if not specified
+        lat = criteria.get('lat', 40.4168)
+        lng = criteria.get('lng', -3.7038)
+        zip_code = criteria.get('zip', '28522')
+
+        cache_key = f"{market}_{model}_{condition}_{criteria.get('trim','all')}"
+
+        # Check cache
+        entry = self.cache.get(cache_key)
+        if entry is not None and (time.monotonic() - entry.ts) < self.cache_ttl:
+            self.cache.move_to_end(cache_key)
+            logger.info(f"Using cached inventory for {cache_key}")
+            return entry.results
+
+        task = self._inflight.get(cache_key)
+        if task is None:
+            params, headers = self._build_request_fingerprint(
+                market, model, condition, zip_code, criteria.get('trim'), lat, lng
+            )
+            task = asyncio.ensure_future(self._fetch(cache_key, params, headers))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        else:
+            logger.info(f"Joining in-flight inventory request for {cache_key}")
+        # Shielded: one caller being cancelled must not abort the fetch the others wait on
+        return await asyncio.shield(task)
+
+    async def _fetch(self, cache_key, params, headers):
+        """
+        Fetch, parse and cache one inventory query. Returns [] on failure.
+        """
         try:
-            # Proxy support (if needed, but direct seems to work now)
-            mounts = {}
-            proxy = os.getenv('INVENTORY_PROXY')
-            if proxy:
-                mounts["https://"] = httpx.HTTPTransport(proxy=proxy, http2=True)
-                mounts["http://"] = httpx.HTTPTransport(proxy=proxy, http2=True)
-                logger.info(f"Using proxy: {proxy.split('@')[-1]}")
-
-            # Use httpx with HTTP/2
-            async with httpx.AsyncClient(timeout=20.0, http2=True, mounts=mounts if proxy else None) as client:
-                resp = await client.get(url, params=params, headers=headers)
-
-                if resp.status_code == 200:
-                    data = resp.json()
-                    results = data.get('results', [])
-                    # Update cache
-                    self.cache[cache_key] = {
-                        "timestamp": datetime.now().timestamp(),
-                        "results": results
-                    }
-                    return results
-                else:
-                    logger.error(f"Inventory API Error {resp.status_code}")
-                    logger.error(f"Req URL: {url}")
-                    logger.error(f"Resp Body: {resp.text[:500]}") # Truncate for sanity
-                    return []
+            client = await self._get_client()
+            for attempt in range(MAX_ATTEMPTS):
+                async with self._sem:
+                    resp = await client.get(INVENTORY_URL, params=params, headers=headers)
+                if resp.status_code not in RETRY_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                    break
+                delay = retry_delay(resp, attempt)
+                logger.warning(f"Inventory API {resp.status_code} for {cache_key}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+            if resp.status_code == 200:
+                data = orjson.loads(resp.content)
+                # Keep only the fields we use so cached results don't pin the full payload
+                results = [Car.from_result(car) for car in data.get('results', [])]
+                # Update cache
+                self.cache[cache_key] = _CacheEntry(time.monotonic(), results)
+                self.cache.move_to_end(cache_key)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                return results
+            else:
+                logger.error(f"Inventory API Error {resp.status_code}")
+                logger.error(f"Req URL: {INVENTORY_URL}")
+                logger.error(f"Resp Body: {resp.text[:500]}") # Truncate for sanity
+                return []
         except Exception as e:
             logger.error(f"Inventory Request Failed: {e}")
             return []
@@ -139,65 +298,34 @@ class InventoryManager:
         """
         matches = []
         max_price = criteria.get('price')
+        condition_mode = criteria.get('condition_mode', 'all_new')
         required_options = criteria.get('options', []) # List of option codes e.g. ['W40B', 'PPSW']
-        
+
+        # Normalize once per call: strip '$' prefix from user criteria
+        clean_required = frozenset(opt.lstrip('$') for opt in required_options)
+
+        req_others, or_groups = group_criteria(clean_required, criteria.get('model', 'my'))
+
         for car in results:
             # Price Check
-            price = car.get('OnTheRoadPrice', car.get('Price', 999999))
-            if max_price and price > max_price:
+            if max_price and car.price > max_price:
                 continue
                 
             # Condition Mode Check (Brand New vs Demo)
-            condition_mode = criteria.get('condition_mode', 'all_new')
-            is_demo = car.get('IsDemo', False)
-            
-            if condition_mode == 'brand_new' and is_demo:
+            if condition_mode == 'brand_new' and car.is_demo:
                 continue # Skip demos
-            if condition_mode == 'demo' and not is_demo:
+            if condition_mode == 'demo' and not car.is_demo:
                 continue # Skip non-demos
 
-            # Option Check
-            car_options = car.get('OptionCodeMap', {}).keys()
-            # If we don't have map, parsing options list might be needed, but simplified for now:
-            if not car_options:
-                car_options = car.get('OptionCodeList', [])
-                
-            if required_options:
-                # Normalize: Strip '$' prefix from both user criteria and car options
-                clean_required = [opt.lstrip('$') for opt in required_options]
-                
-                # Handle parsing of OptionCodeList (can be string or list)
-                if isinstance(car_options, str):
-                    car_options = car_options.split(',')
-                    
-                clean_car_options = set([opt.lstrip('$') for opt in car_options]) # Use set for O(1) lookup
-
-                # Categorize filters
-                # Trims (MT*), Paint (P*), Wheels (W*) are treated as OR groups.
-                # Everything else is AND.
-                
-                req_trims = [o for o in clean_required if o.startswith('MT')]
-                req_paint = [o for o in clean_required if o.startswith('P')]
-                req_wheels = [o for o in clean_required if o.startswith('W')]
-                
-                # Others: Everything else MUST be present (AND)
-                grouped = set(req_trims + req_paint + req_wheels)
-                req_others = [o for o in clean_required if o not in grouped]
+            if clean_required:
+                car_options = car.options
 
                 # 1. Check Others (AND)
-                if not all(opt in clean_car_options for opt in req_others):
+                if not req_others.issubset(car_options):
                     continue
-                    
-                # 2. Check Trims (OR) - If ANY trim selected, car must match ONE of them
-                if req_trims and not any(opt in clean_car_options for opt in req_trims):
-                    continue
-                    
-                # 3. Check Paint (OR)
-                if req_paint and not any(opt in clean_car_options for opt in req_paint):
-                    continue
-                    
-                # 4. Check Wheels (OR)
-                if req_wheels and not any(opt in clean_car_options for opt in req_wheels):
+
+                # 2. Check each OR group - car must match ONE code of every selected group
+                if any(group.isdisjoint(car_options) for group in or_groups):
                     continue
             
             matches.append(car)
@@ -205,25 +333,17 @@ class InventoryManager:
         return matches
 
     def format_car(self, car):
-        model = car.get('Model', 'Unknown Model')
-        vin = car.get('VIN', 'N/A')
-        price = car.get('OnTheRoadPrice', car.get('Price', 'N/A'))
-        currency = car.get('CurrencyCode', 'EUR')
-        trim = car.get('TrimName', 'Unknown Trim')
-        paint_data = car.get('PAINT')
-        color = paint_data[0] if isinstance(paint_data, list) and paint_data else 'Unknown Color'
-        city = car.get('City', 'Unknown Location')
-        odometer = car.get('Odometer', 'Unknown Odometer')
-        odometerType = car.get('OdometerType', 'Unknown Odometer Type')
+        vin = car.vin or 'N/A'
+        price = car.price if car.price != float('inf') else 'N/A'
         
         msg = (
             f"🚙 **Inventory Found!**\n"
-            f"**Model:** {model}\n"
-            f"**Price:** {price} {currency}\n"
-            f"**Trim:** {trim}\n"
-            f"**Odometer:** {odometer} {odometerType}\n"
-            f"**Color:** {color}\n"
-            f"**City:** {city}\n"
-            f"🔗 [View Car](https://www.tesla.com/{car.get('Language','es')}_{car.get('Market','ES')}/{model}/order/{vin}?#aux-1-content)"
+            f"**Model:** {car.model}\n"
+            f"**Price:** {price} {car.currency}\n"
+            f"**Trim:** {car.trim}\n"
+            f"**Odometer:** {car.odometer} {car.odometer_type}\n"
+            f"**Color:** {car.color}\n"
+            f"**City:** {car.city}\n"
+            f"🔗 [View Car](https://www.tesla.com/{car.language}_{car.market}/{car.model}/order/{vin}?#aux-1-content)"
         )
         return msg
@@ -1,22 +1,37 @@
 import os
-import json
 import asyncio
 import logging
+import sqlite3
+import hashlib
 import httpx
-from aiohttp import web
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import orjson
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
-from functools import wraps
-from inventory import InventoryManager
-from option_codes import OPTION_CODES_DATA
-import uuid
+from functools import wraps, partial, lru_cache
+from collections import OrderedDict
+from io import BytesIO
+from types import MappingProxyType
+from inventory import InventoryManager, OPTION_CODES
+from scheduler import PollScheduler
+from option_codes import OPTION_CODES_DATA, CODE_TO_CATEGORY
+import threading
+import time
+import secrets
+import random
 
 # --- Configuration ---
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
-DB_FILE = '/data/tesla_users_v2.json'  # New DB file for multi-user
+DB_FILE = '/data/tesla_users.db'  # SQLite, one row per user
+LEGACY_DB_FILE = '/data/tesla_users_v2.json'  # Old single-file JSON DB, migrated on first start
+DB_SAVE_DELAY = 1.0  # seconds to coalesce DB writes before flushing
 CLIENT_ID = 'ownerapi'
 TOKEN_URL = 'https://auth.tesla.com/oauth2/v3/token'
 APP_VERSION = '4.48.1-3479'
+POLL_BACKOFF = 1.5  # interval multiplier per poll without changes
+MAX_POLL_INTERVAL = 2 * 60 * 60  # backoff cap (seconds)
+IMAGE_CACHE_SIZE = 32  # downloaded renders kept in memory
+SEEN_VINS_CAP = 1000  # per watch; the oldest VINs are forgotten first
 
 # --- Logging ---
 logging.basicConfig(
@@ -28,95 +43,414 @@ logger = logging.getLogger(__name__)
 # --- Decoders & Data (Re-used) ---
 
 FACTORY_CODES = {'F': 'Fremont', 'C': 'Shanghai', 'B': 'Berlin', 'A': 'Austin'}
+YEAR_MAP = {'M': 2021, 'N': 2022, 'P': 2023, 'R': 2024, 'S': 2025, 'T': 2026}
 
 def decode_vin(vin):
     if not vin or len(vin) != 17: return None
     plant = FACTORY_CODES.get(vin[10], "Unknown Factory")
-    year_map = {'M': 2021, 'N': 2022, 'P': 2023, 'R': 2024, 'S': 2025, 'T': 2026}
-    year = year_map.get(vin[9], "Unknown Year")
+    year = YEAR_MAP.get(vin[9], "Unknown Year")
     return f"{plant} ({year})"
 
 def get_image_url(options, model_code):
-    opts_clean = [c for c in options if c != '']
-    opt_string = ",".join(opts_clean)
-    model = 'm3' if 'mdl3' in model_code.lower() else 'my'
-    if 'model3' in model_code.lower(): model = 'm3'
-    if 'modely' in model_code.lower(): model = 'my'
+    return _build_url(tuple(options), model_code)
+
+@lru_cache(maxsize=1024)
+def _build_url(options, model_code):
+    # Option sets barely change between polls, so the composed URL is memoized
+    opt_string = ",".join(filter(None, options))
+    mc = model_code.lower()
+    model = 'm3' if ('mdl3' in mc or 'model3' in mc) and 'modely' not in mc else 'my'
     return f"https://static-assets.tesla.com/configurator/compositor?model={model}&options={opt_string}&view=STUD_3QTR&size=1920&bkba_opt=1&crop=1400,850,300,300"
 
+_image_cache = OrderedDict()  # {url hash: image bytes}, LRU
+
+def image_key(url):
+    return hashlib.blake2b(url.encode()).hexdigest()
+
+async def fetch_image(key, url):
+    """Download a compositor render once; repeat calls are served from memory."""
+    data = _image_cache.get(key)
+    if data is not None:
+        _image_cache.move_to_end(key)
+        return data
+    resp = await HTTP.get(url)
+    resp.raise_for_status()
+    data = _image_cache[key] = resp.content
+    if len(_image_cache) > IMAGE_CACHE_SIZE:
+        _image_cache.popitem(last=False)
+    return data
+
+async def drop_cached_images(db, chat_id, keys):
+    """Forget file_ids Telegram rejected, so those renders are uploaded again."""
+    user = await db.get_user(chat_id)
+    cache = (user or {}).get('image_cache', {})
+    if any(key in cache for key in keys):
+        await db.update_user(chat_id, {'image_cache': {k: v for k, v in cache.items() if k not in keys}})
+
+async def send_cached_photo(send, db, chat_id, url, **kwargs):
+    """Send a compositor render, reusing Telegram's file_id when this exact render was sent before."""
+    user = await db.get_user(chat_id) or {}
+    key = image_key(url)
+    file_id = user.get('image_cache', {}).get(key)
+    if file_id:
+        try:
+            return await send(file_id, **kwargs)
+        except BadRequest as e:
+            # Stale or invalid file_id: drop it and upload the render once more
+            logger.warning(f"Cached photo rejected for {chat_id}, re-uploading: {e}")
+            await drop_cached_images(db, chat_id, {key})
+    message = await send(BytesIO(await fetch_image(key, url)), **kwargs)
+    if message.photo:
+        # Re-read: concurrent sends may have added their own file_ids meanwhile
+        user = await db.get_user(chat_id)
+        if user is not None:
+            await db.update_user(chat_id, {'image_cache': {**user.get('image_cache', {}), key: message.photo[-1].file_id}})
+    return message
+
+MAX_MESSAGE_LEN = 4096  # Telegram's per-message text limit
+
+async def send_batched(send, parts, **kwargs):
+    """Send parts joined by blank lines via `send(text)`, in as few messages as the length limit allows."""
+    chunk = ""
+    for part in parts:
+        if chunk and len(chunk) + 2 + len(part) > MAX_MESSAGE_LEN:
+            await send(chunk, **kwargs)
+            chunk = ""
+        chunk = f"{chunk}\n\n{part}" if chunk else part
+    if chunk:
+        await send(chunk, **kwargs)
+
+async def reply_batched(message, parts, **kwargs):
+    await send_batched(message.reply_text, parts, **kwargs)
+
+async def send_order_updates(bot, db, chat_id, updates):
+    """
+    Deliver (msg, url) order updates as albums of up to 10 instead of one send per order.
+    Returns how many updates went out; if a send fails, the rest are left to the caller.
+    """
+    for i in range(0, len(updates), 10):
+        try:
+            await send_order_batch(bot, db, chat_id, updates[i:i + 10])
+        except (BadRequest, httpx.HTTPError) as e:
+            logger.warning(f"Photo send failed for {chat_id}, falling back to text: {e}")
+            return i
+    return len(updates)
+
+async def send_order_batch(bot, db, chat_id, batch):
+    """Send up to 10 updates: one photo, or an album reusing cached file_ids."""
+    # Albums need at least 2 items
+    if len(batch) == 1:
+        msg, url = batch[0]
+        await send_cached_photo(partial(bot.send_photo, chat_id), db, chat_id, url, caption=msg, parse_mode='Markdown')
+        return
+    
+    user = await db.get_user(chat_id) or {}
+    cache = user.get('image_cache', {})
+    keys = [image_key(url) for _, url in batch]
+    
+    async def album():
+        return [
+            InputMediaPhoto(cache.get(key) or await fetch_image(key, url), caption=msg, parse_mode='Markdown')
+            for key, (msg, url) in zip(keys, batch)
+        ]
+    
+    try:
+        messages = await bot.send_media_group(chat_id, await album())
+    except BadRequest as e:
+        stale = {key for key in keys if key in cache}
+        if not stale:
+            raise
+        # A cached file_id went stale: drop the album's ids and upload the renders once more
+        logger.warning(f"Cached photos rejected for {chat_id}, re-uploading: {e}")
+        await drop_cached_images(db, chat_id, stale)
+        cache = {k: v for k, v in cache.items() if k not in stale}
+        messages = await bot.send_media_group(chat_id, await album())
+    new_ids = {key: m.photo[-1].file_id for key, m in zip(keys, messages) if key not in cache and m.photo}
+    if new_ids:
+        await db.update_user(chat_id, {'image_cache': {**cache, **new_ids}})
+
 # --- Database Manager ---
 class UserDatabase:
     def __init__(self):
         self.lock = asyncio.Lock()
         self.users = {} # {chat_id (str): UserDict}
+        self._auth_index = set() # chat_ids holding a refresh_token, for check_auth
+        # Debounced writer: mutations mark users dirty, a background task flushes them
+        self._dirty = set() # chat_ids whose user row changed (or was deleted) since the last flush
+        self._dirty_watches = set() # chat_ids whose watch rows changed since the last flush
+        self._dirty_watch_ids = set() # (chat_id, watch_id) of single watches changed in place
+        self._dirty_event = asyncio.Event()
+        self._writer = None
+        self._flushing = None # executor future of the batch being written, if any
+        # Serializes access to the SQLite connection from executor threads
+        self._conn_lock = threading.Lock()
+        self.conn = None
         self.load()
 
+    def start(self):
+        """Start the background writer (needs a running event loop)."""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._writer_loop())
+
+    async def close(self):
+        """Stop the writer, flush any pending changes and close the DB."""
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        if self._flushing is not None:
+            # The batch is already off the dirty set; let its executor write land first
+            try:
+                await self._flushing
+            except Exception as e:
+                logger.error(f"Failed to write DB batch: {e}")
+            self._flushing = None
+        if self._dirty or self._dirty_watches or self._dirty_watch_ids:
+            self.save()
+        with self._conn_lock:
+            self.conn.close()
+
+    async def _writer_loop(self):
+        while True:
+            await self._dirty_event.wait()
+            # Let a burst of updates coalesce into a single write
+            await asyncio.sleep(DB_SAVE_DELAY)
+            self._dirty_event.clear()
+            async with self.lock:
+                if not (self._dirty or self._dirty_watches or self._dirty_watch_ids):
+                    continue
+                batch = self._take_dirty()
+            # Disk I/O happens off the event loop, outside the DB lock. Shielded: cancelling
+            # the writer can't stop the thread, so close() awaits the write instead
+            self._flushing = asyncio.get_running_loop().run_in_executor(None, self._write_sync, *batch)
+            await asyncio.shield(self._flushing)
+            self._flushing = None
+
+    def _mark_dirty(self, chat_id, user=True, watches=False, watch_id=None):
+        if user:
+            self._dirty.add(chat_id)
+        if watches:
+            self._dirty_watches.add(chat_id)
+        if watch_id is not None:
+            self._dirty_watch_ids.add((chat_id, watch_id))
+        if self._writer is None:
+            # No writer running (e.g. scripts), save straight away
+            self.save()
+            return
+        self._dirty_event.set()
+
+    def _take_dirty(self):
+        """Encode the dirty users and watch lists into rows for _write_sync, and reset the dirty sets."""
+        users = self.users
+        # Watches live in their own table, so they are left out of the user document
+        rows = [(cid, orjson.dumps({k: v for k, v in users[cid].items() if k != 'watches'})) for cid in self._dirty if cid in users]
+        deleted = [(cid,) for cid in self._dirty if cid not in users]
+        # A dirty watch list is replaced wholesale: drop the user's rows, insert the current ones
+        watch_owners = [(cid,) for cid in self._dirty_watches]
+        watch_rows = [
+            (cid, w['id'], self._encode_watch(w))
+            for cid in self._dirty_watches if cid in users
+            for w in users[cid].get('watches', {}).values()
+        ]
+        # Single-watch changes are upserted, unless the whole list is being replaced anyway
+        for cid, wid in self._dirty_watch_ids:
+            if cid in self._dirty_watches or cid not in users:
+                continue
+            watch = users[cid].get('watches', {}).get(wid)
+            if watch is not None:
+                watch_rows.append((cid, wid, self._encode_watch(watch)))
+        self._dirty = set()
+        self._dirty_watches = set()
+        self._dirty_watch_ids = set()
+        return rows, deleted, watch_owners, watch_rows
+
+    @staticmethod
+    def _encode_watch(watch):
+        # seen_vins is an insertion-ordered dict in memory, a plain list on disk
+        return orjson.dumps({**watch, 'seen_vins': list(watch.get('seen_vins', ()))})
+
     def load(self):
-        if os.path.exists(DB_FILE):
+        self.conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS users (chat_id TEXT PRIMARY KEY, doc BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS watches (chat_id TEXT NOT NULL, id TEXT NOT NULL, doc BLOB NOT NULL, PRIMARY KEY (chat_id, id))")
+        try:
+            self.users = {cid: orjson.loads(doc) for cid, doc in self.conn.execute("SELECT chat_id, doc FROM users")}
+            # Documents written before the watches table still embed their watch list; move it over
+            embedded = [cid for cid, user in self.users.items() if 'watches' in user]
+            for cid, doc in self.conn.execute("SELECT chat_id, doc FROM watches ORDER BY rowid"):
+                if cid in self.users:
+                    self.users[cid].setdefault('watches', []).append(orjson.loads(doc))
+            self._index_watches()
+            if embedded:
+                self._dirty.update(embedded)
+                self._dirty_watches.update(embedded)
+                self.save()
+        except Exception as e:
+            logger.error(f"Failed to load DB: {e}")
+            self.users = {}
+
+        if not self.users and os.path.exists(LEGACY_DB_FILE):
             try:
-                with open(DB_FILE, 'r') as f:
-                    self.users = json.load(f)
+                with open(LEGACY_DB_FILE, 'rb') as f:
+                    self.users = orjson.loads(f.read())
+                self._index_watches()
+                self._dirty = set(self.users)
+                self._dirty_watches = set(self.users)
+                self.save()
+                logger.info(f"Migrated {len(self.users)} users from {LEGACY_DB_FILE}")
             except Exception as e:
-                logger.error(f"Failed to load DB: {e}")
-                self.users = {}
+                logger.error(f"Failed to migrate legacy DB: {e}")
+
+        self._auth_index = {cid for cid, user in self.users.items() if 'refresh_token' in user}
+
+    def _index_watches(self):
+        """Turn stored watch lists into {watch_id: watch}, with seen_vins as an ordered set."""
+        for user in self.users.values():
+            watches = user.get('watches')
+            if isinstance(watches, list):
+                user['watches'] = {w['id']: w for w in watches}
+            for w in user.get('watches', {}).values():
+                # dict keys as an ordered set: O(1) membership, oldest-first eviction
+                w['seen_vins'] = dict.fromkeys(w.get('seen_vins', ()))
 
     def save(self):
-        """Sync save (should be quick for small DB). Call in executor if large."""
-        temp = DB_FILE + '.tmp'
-        with open(temp, 'w') as f:
-            json.dump(self.users, f)
-        os.replace(temp, DB_FILE)
+        """Sync flush of pending changes. The background writer encodes here and writes via _write_sync in an executor."""
+        self._write_sync(*self._take_dirty())
+
+    def _write_sync(self, rows, deleted, watch_owners, watch_rows):
+        with self._conn_lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO users (chat_id, doc) VALUES (?, ?) ON CONFLICT(chat_id) DO UPDATE SET doc = excluded.doc",
+                rows
+            )
+            self.conn.executemany("DELETE FROM users WHERE chat_id = ?", deleted)
+            self.conn.executemany("DELETE FROM watches WHERE chat_id = ?", deleted + watch_owners)
+            self.conn.executemany(
+                "INSERT INTO watches (chat_id, id, doc) VALUES (?, ?, ?) ON CONFLICT(chat_id, id) DO UPDATE SET doc = excluded.doc",
+                watch_rows
+            )
+
+    # Reads are lock-free: writers never await mid-mutation, so on a single
+    # event loop a reader can't observe a half-applied update
+    # chat_ids are str throughout: handlers convert update.effective_chat.id once
+    # at the edge, and jobs are scheduled with those str ids
 
     async def get_user(self, chat_id):
-        async with self.lock:
-            return self.users.get(str(chat_id))
+        return self.users.get(chat_id)
+
+    def is_authorized(self, chat_id):
+        return chat_id in self._auth_index
 
     async def update_user(self, chat_id, data):
         async with self.lock:
-            chat_id = str(chat_id)
-            if chat_id not in self.users:
+            is_new = chat_id not in self.users
+            if is_new:
                 self.users[chat_id] = {}
             self.users[chat_id].update(data)
-            self.save()
+            if 'refresh_token' in data:
+                self._auth_index.add(chat_id)
+            # A watches-only update (seen_vins bookkeeping) leaves the user row alone
+            self._mark_dirty(chat_id, user=is_new or not data.keys() <= {'watches'}, watches='watches' in data)
 
     async def delete_user(self, chat_id):
         async with self.lock:
-            if str(chat_id) in self.users:
-                del self.users[str(chat_id)]
-                self.save()
+            if chat_id in self.users:
+                del self.users[chat_id]
+                self._auth_index.discard(chat_id)
+                self._mark_dirty(chat_id)
             
     async def get_all_users(self):
-        async with self.lock:
-            return list(self.users.keys())
+        return list(self.users)
+
+    async def get_all_users_full(self):
+        """Return (chat_id, user) pairs for every user in one call."""
+        return list(self.users.items())
 
     def add_watch(self, chat_id, criteria):
-        user = self.users.get(str(chat_id))
+        """
+        Store a new watch and return its id. The watch's 'seen_vins' is an ordered set,
+        oldest first: persisted as a list in that order, and trimmed from the front
+        once it exceeds SEEN_VINS_CAP.
+        """
+        user = self.users.get(chat_id)
         if not user: return None
         
-        if 'watches' not in user: user['watches'] = []
-        
-        watch_id = str(uuid.uuid4())[:8]
+        watch_id = secrets.token_hex(4)
         criteria['id'] = watch_id
-        user['watches'].append(criteria)
-        self.save()
+        user.setdefault('watches', {})[watch_id] = criteria
+        self._mark_dirty(chat_id, user=False, watches=True)
         return watch_id
 
+    async def update_watch_seen_vins(self, chat_id, new_vins_by_watch):
+        """
+        Add VINs to watches' seen sets ({watch_id: [vin, ...]}) in one call, capped at
+        SEEN_VINS_CAP per watch. Only the touched watch rows are rewritten.
+        """
+        async with self.lock:
+            watches = (self.users.get(chat_id) or {}).get('watches', {})
+            for watch_id, new_vins in new_vins_by_watch.items():
+                w = watches.get(watch_id)
+                if w is None:
+                    continue # deleted while the check was running
+                seen = w.setdefault('seen_vins', {})
+                for vin in new_vins:
+                    # Re-adding moves the VIN to the young end
+                    seen.pop(vin, None)
+                    seen[vin] = None
+                while len(seen) > SEEN_VINS_CAP:
+                    del seen[next(iter(seen))]
+                self._mark_dirty(chat_id, user=False, watch_id=watch_id)
+
+    async def replace_watch(self, chat_id, watch_id, criteria):
+        """
+        Replace a watch's criteria in place, keeping its id and seen VINs. Only that watch's
+        row is rewritten. Returns False if there is no such watch.
+        """
+        async with self.lock:
+            watches = (self.users.get(chat_id) or {}).get('watches', {})
+            old = watches.get(watch_id)
+            if old is None:
+                return False
+            watches[watch_id] = {**criteria, 'id': watch_id, 'seen_vins': old.get('seen_vins', {})}
+            self._mark_dirty(chat_id, user=False, watch_id=watch_id)
+            return True
+
+    async def clear_watch_seen_vins(self, chat_id, watch_id):
+        """Forget every VIN a watch has reported. Returns False if there is no such watch."""
+        async with self.lock:
+            w = (self.users.get(chat_id) or {}).get('watches', {}).get(watch_id)
+            if w is None:
+                return False
+            w['seen_vins'] = {}
+            self._mark_dirty(chat_id, user=False, watch_id=watch_id)
+            return True
+
     def remove_watch(self, chat_id, watch_id):
-        user = self.users.get(str(chat_id))
+        user = self.users.get(chat_id)
         if not user or 'watches' not in user: return False
         
-        initial = len(user['watches'])
-        user['watches'] = [w for w in user['watches'] if w['id'] != watch_id]
-        if len(user['watches']) < initial:
-            self.save()
-            return True
-        return False
+        if user['watches'].pop(watch_id, None) is None:
+            return False
+        self._mark_dirty(chat_id, user=False, watches=True)
+        return True
 
 # --- Tesla Client (Per User) ---
+# Shared across all users so auth/owner-api connections stay warm (keep-alive + HTTP/2)
+# Handed to TeslaClient through bot_data['http']
+HTTP = httpx.AsyncClient(http2=True, timeout=30, limits=httpx.Limits(max_keepalive_connections=20, max_connections=40))
+# Caps concurrent owner-API calls across all users, so a burst of due polls can't pile up on Tesla
+TESLA_SEM = asyncio.Semaphore(int(os.getenv('TESLA_MAX_CONCURRENCY', '20')))
+
 class TeslaClient:
-    def __init__(self, chat_id, db: UserDatabase):
+    def __init__(self, chat_id, db: UserDatabase, http: httpx.AsyncClient):
         self.chat_id = chat_id
         self.db = db
+        self.http = http
+        self._etags = {} # {url: (etag, parsed body)}
         self.headers = {'User-Agent': f'TeslaApp/{APP_VERSION}', 'X-Tesla-User-Agent': f'TeslaApp/{APP_VERSION}'}
 
     async def _get_token(self):
@@ -124,28 +458,32 @@ class TeslaClient:
         if not user or 'refresh_token' not in user:
             raise Exception("User not logged in.")
         
-        # Check if we assume access token is valid or just try and catch 401
-        # Simple strategy: Try with current, refresh on 401
-        return user.get('access_token'), user['refresh_token']
+        # A known-expired token is reported as missing so request() refreshes
+        # up front instead of paying for a call that is bound to 401
+        access_token = user.get('access_token')
+        if time.time() >= user.get('expires_at', 0):
+            access_token = None
+        return access_token, user['refresh_token']
 
     async def _refresh(self, refresh_token):
-        async with httpx.AsyncClient() as client:
-            payload = {
-                'grant_type': 'refresh_token',
-                'client_id': CLIENT_ID,
-                'refresh_token': refresh_token,
-                'scope': 'openid email offline_access'
-            }
-            resp = await client.post(TOKEN_URL, json=payload)
-            resp.raise_for_status()
-            data = resp.json()
-            
-            # Update DB with new tokens
-            await self.db.update_user(self.chat_id, {
-                'access_token': data['access_token'],
-                'refresh_token': data['refresh_token']
-            })
-            return data['access_token']
+        payload = {
+            'grant_type': 'refresh_token',
+            'client_id': CLIENT_ID,
+            'refresh_token': refresh_token,
+            'scope': 'openid email offline_access'
+        }
+        async with TESLA_SEM:
+            resp = await self.http.post(TOKEN_URL, json=payload)
+        resp.raise_for_status()
+        data = orjson.loads(resp.content)
+        
+        # Update DB with new tokens (expiry kept 60s early to absorb clock skew)
+        await self.db.update_user(self.chat_id, {
+            'access_token': data['access_token'],
+            'refresh_token': data['refresh_token'],
+            'expires_at': time.time() + data.get('expires_in', 28800) - 60
+        })
+        return data['access_token']
 
     async def request(self, method, url):
         access_token, refresh_token = await self._get_token()
@@ -153,24 +491,35 @@ class TeslaClient:
         if not access_token:
             access_token = await self._refresh(refresh_token)
             
-        async with httpx.AsyncClient() as client:
-            try:
+        cached = self._etags.get(url)
+        headers = {**self.headers, 'If-None-Match': cached[0]} if cached else self.headers
+        
+        try:
+            if method == 'GET':
+                async with TESLA_SEM:
+                    resp = await self.http.get(url, headers={**headers, 'Authorization': f'Bearer {access_token}'})
+            
+            if resp.status_code == 401:
+                logger.info(f"Token expired for user {self.chat_id}, refreshing...")
+                access_token = await self._refresh(refresh_token)
+                # Retry once
                 if method == 'GET':
-                    resp = await client.get(url, headers={**self.headers, 'Authorization': f'Bearer {access_token}'})
-                
-                if resp.status_code == 401:
-                    logger.info(f"Token expired for user {self.chat_id}, refreshing...")
-                    access_token = await self._refresh(refresh_token)
-                    # Retry once
-                    if method == 'GET':
-                        resp = await client.get(url, headers={**self.headers, 'Authorization': f'Bearer {access_token}'})
-                
-                resp.raise_for_status()
-                return resp.json()
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 401:
-                    raise Exception("Auth Failed: Token Expired and Refresh Failed. Please /login again.")
-                raise
+                    async with TESLA_SEM:
+                        resp = await self.http.get(url, headers={**headers, 'Authorization': f'Bearer {access_token}'})
+            
+            # Unchanged upstream: hand back the body parsed last time
+            if resp.status_code == 304 and cached:
+                return cached[1]
+            
+            resp.raise_for_status()
+            data = orjson.loads(resp.content)
+            if etag := resp.headers.get('ETag'):
+                self._etags[url] = (etag, data)
+            return data
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 401:
+                raise Exception("Auth Failed: Token Expired and Refresh Failed. Please /login again.")
+            raise
 
     async def get_orders(self):
         url = 'https://owner-api.teslamotors.com/api/1/users/orders'
@@ -181,16 +530,22 @@ class TeslaClient:
         url = f'https://akamai-apigateway-vfx.tesla.com/tasks?deviceLanguage=en&deviceCountry=US&referenceNumber={order_id}&appVersion={APP_VERSION}'
         return await self.request('GET', url)
 
+def get_client(bot_data, chat_id):
+    """One TeslaClient per user, kept across polls so its ETag cache carries over."""
+    clients = bot_data['clients']
+    client = clients.get(chat_id)
+    if client is None:
+        client = clients[chat_id] = TeslaClient(chat_id, bot_data['db'], bot_data['http'])
+    return client
+
 # --- Decorators & Error Handling ---
 
 def check_auth(func):
     """Decorator to enforce login"""
     @wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        chat_id = update.effective_chat.id
-        db = context.bot_data['db']
-        user = await db.get_user(chat_id)
-        if not user or 'refresh_token' not in user:
+        chat_id = str(update.effective_chat.id)
+        if not context.bot_data['db'].is_authorized(chat_id):
             await update.message.reply_text("⚠️ **Not Authorized**\nPlease log in first:\n`/login <refresh_token>`", parse_mode='Markdown')
             return
         return await func(update, context, *args, **kwargs)
@@ -235,7 +590,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg, parse_mode='Markdown')
 
 async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     args = context.args
     
     if not args:
@@ -251,17 +606,18 @@ async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Save momentarily
         await db.update_user(chat_id, {'refresh_token': refresh_token, 'access_token': None, 'interval': 30})
         
-        client = TeslaClient(chat_id, db)
+        client = get_client(context.bot_data, chat_id)
         orders = await client.get_orders()
         
         await status_msg.edit_text(f"✅ Success! Found {len(orders)} orders.\nPolling started (30m interval).")
-        start_job(context.job_queue, chat_id, 30*60)
+        start_job(context.application, chat_id, 30*60)
         
         try: await update.message.delete()
         except: pass 
             
     except Exception as e:
         await db.delete_user(chat_id)
+        context.bot_data['clients'].pop(chat_id, None)
         err_msg = str(e)
         if "401" in err_msg or "Auth Failed" in err_msg:
             err_msg = "Token Expired or Invalid. Please generate a new one."
@@ -269,23 +625,23 @@ async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @check_auth
 async def logout_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     db = context.bot_data['db']
     
     await db.delete_user(chat_id)
+    context.bot_data['clients'].pop(chat_id, None)
+    context.bot_data['stable_polls'].pop(chat_id, None)
     
-    jobs = context.job_queue.get_jobs_by_name(str(chat_id))
-    for job in jobs: job.schedule_removal()
-
+    scheduler = context.bot_data['scheduler']
+    scheduler.remove(chat_id)
     # Also remove inventory jobs
-    inv_jobs = context.job_queue.get_jobs_by_name(f"inv_{chat_id}")
-    for job in inv_jobs: job.schedule_removal()
+    scheduler.remove(f"inv_{chat_id}")
         
     await update.message.reply_text("👋 Logged out. Data removed.")
 
 @check_auth
 async def interval_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     args = context.args
     db = context.bot_data['db']
     
@@ -299,16 +655,17 @@ async def interval_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     await db.update_user(chat_id, {'interval': minutes})
-    start_job(context.job_queue, chat_id, minutes*60)
+    context.bot_data['stable_polls'][chat_id] = 0
+    start_job(context.application, chat_id, minutes*60)
     await update.message.reply_text(f"✅ Polling interval set to {minutes} minutes.")
 
 # --- Specific Feature Commands ---
 
 @check_auth
 async def generic_info_command(update: Update, context, mode):
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     db = context.bot_data['db']
-    client = TeslaClient(chat_id, db)
+    client = get_client(context.bot_data, chat_id)
     
     try:
         orders = await client.get_orders()
@@ -316,26 +673,35 @@ async def generic_info_command(update: Update, context, mode):
             await update.message.reply_text("No orders found.")
             return
 
+        # vin/options/image only need the order summary, no per-order details fetch
+        if mode == 'image':
+            # One photo per order, sent concurrently
+            await asyncio.gather(*(
+                send_cached_photo(update.message.reply_photo, db, chat_id,
+                                  get_image_url(order.get('optionCodeList', []), order.get('modelCode', 'my')),
+                                  caption=f"📸 {order['referenceNumber']}")
+                for order in orders
+            ))
+            return
+        
+        # Text modes: one block per order, sent as a single message
+        parts = []
         for order in orders:
             rn = order['referenceNumber']
-            details = await client.get_order_details(rn)
             
             if mode == 'vin':
                 vin = order.get('vin')
                 intel = decode_vin(vin)
-                await update.message.reply_text(f"🚗 **{rn}**\nVIN: `{vin or 'None'}`\nFactory: {intel or 'Unknown'}", parse_mode='Markdown')
+                parts.append(f"🚗 **{rn}**\nVIN: `{vin or 'None'}`\nFactory: {intel or 'Unknown'}")
             
             elif mode == 'options':
                 codes = order.get('optionCodeList', [])
-                decoded = []
-                for c in codes:
-                    if c in OPTION_CODES: decoded.append(f"`{c}`: {OPTION_CODES[c]}")
+                oc = OPTION_CODES
+                decoded = [f"`{c}`: {name}" for c in codes if (name := oc.get(c)) is not None]
                 desc = "\n".join(decoded) or "No known options."
-                await update.message.reply_text(f"🧬 **{rn} Configuration**\n{desc}", parse_mode='Markdown')
-            
-            elif mode == 'image':
-                url = get_image_url(order.get('optionCodeList', []), order.get('modelCode', 'my'))
-                await update.message.reply_photo(url, caption=f"📸 {rn}")
+                parts.append(f"🧬 **{rn} Configuration**\n{desc}")
+        
+        await reply_batched(update.message, parts, parse_mode='Markdown')
 
     except Exception as e:
         await update.message.reply_text(f"Error: {e}")
@@ -409,22 +775,28 @@ async def select_market(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['watch_config']['market'] = query.data
     return await show_main_menu(query, context)
 
-async def show_main_menu(query, context):
-    cfg = context.user_data['watch_config']
-    
-    # Summary
+CONDITION_LABELS = {
+    'all_new': 'New (All)',
+    'brand_new': 'Brand New Only',
+    'demo': 'Demo Only',
+    'used': 'Used'
+}
+
+# Static, so built once and shared by every menu render
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💰 Set Max Price", callback_data="action_price")],
+    [InlineKeyboardButton("📋 Set Condition", callback_data="action_condition")],
+    [InlineKeyboardButton("🎨 Add Filters (Paint/Wheels...)", callback_data="action_filter")],
+    [InlineKeyboardButton("✅ Start Watch", callback_data="action_save")],
+    [InlineKeyboardButton("❌ Cancel", callback_data="action_cancel")]
+])
+
+def _build_main_menu(cfg):
+    """Watch wizard summary text and keyboard, shared by the callback and text-input paths."""
     price_str = f"{cfg['price']} EUR" if cfg['price'] else "Any"
     opts_str = ", ".join(cfg['options']) if cfg['options'] else "None"
-    
-    # Condition Label
     c_mode = cfg.get('condition_mode', 'all_new')
-    c_map = {
-        'all_new': 'New (All)',
-        'brand_new': 'Brand New Only',
-        'demo': 'Demo Only',
-        'used': 'Used'
-    }
-    cond_str = c_map.get(c_mode, c_mode)
+    cond_str = CONDITION_LABELS.get(c_mode, c_mode)
     
     text = (
         f"⚙️ **Watch Configuration**\n"
@@ -435,16 +807,11 @@ async def show_main_menu(query, context):
         f"• Filters: `{opts_str}`\n\n"
         f"Select an action:"
     )
-    
-    keyboard = [
-        [InlineKeyboardButton("💰 Set Max Price", callback_data="action_price")],
-        [InlineKeyboardButton("📋 Set Condition", callback_data="action_condition")],
-        [InlineKeyboardButton("🎨 Add Filters (Paint/Wheels...)", callback_data="action_filter")],
-        [InlineKeyboardButton("✅ Start Watch", callback_data="action_save")],
-        [InlineKeyboardButton("❌ Cancel", callback_data="action_cancel")]
-    ]
-    
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    return text, MAIN_MENU_KEYBOARD
+
+async def show_main_menu(query, context):
+    text, markup = _build_main_menu(context.user_data['watch_config'])
+    await query.edit_message_text(text, reply_markup=markup, parse_mode='Markdown')
     return MAIN_MENU
 
 async def show_condition_menu(query, context):
@@ -512,45 +879,36 @@ async def set_price_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Send a dummy message to attach the menu which expects a callback query update usually
     # But since we came from text, we send a new message
-    msg = await update.message.reply_text("✅ Price set.")
-    
-    # Hacky way to reuse show_main_menu which expects a query with .edit_message_text
-    # We'll just manually call the logic or mock it. Easier to just rewrite menu logic for 'message' context
-    # Or just send new menu.
-    
-    cfg = context.user_data['watch_config']
-    price_str = f"{cfg['price']} EUR" if cfg['price'] else "Any"
-    opts_str = ", ".join(cfg['options']) if cfg['options'] else "None"
+    await update.message.reply_text("✅ Price set.")
     
-    txt = (
-        f"⚙️ **Watch Configuration**\n"
-        f"• Model: `{cfg['model']}`\n"
-        f"• Market: `{cfg['market']}`\n"
-        f"• Price Limit: `{price_str}`\n"
-        f"• Filters: `{opts_str}`\n"
-    )
-    keyboard = [
-        [InlineKeyboardButton("💰 Set Max Price", callback_data="action_price")],
-        [InlineKeyboardButton("🎨 Add Filters (Paint/Wheels...)", callback_data="action_filter")],
-        [InlineKeyboardButton("✅ Start Watch", callback_data="action_save")],
-        [InlineKeyboardButton("❌ Cancel", callback_data="action_cancel")]
-    ]
-    await update.message.reply_text(txt, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    # We came from a text message, not a callback query, so send the menu as a new message
+    text, markup = _build_main_menu(context.user_data['watch_config'])
+    await update.message.reply_text(text, reply_markup=markup, parse_mode='Markdown')
     return MAIN_MENU
 
-async def show_filter_categories(query, context):
-    # Show filters based on options
-    keyboard = []
-
-    # Get model from context
+def wizard_model_options(context):
+    """(option table, code -> category index) for the model being configured, cached in user_data."""
     model = context.user_data['watch_config'].get('model', 'my')
+    cached = context.user_data.get('_model_opts')
+    # Keyed by model, so picking another model (or editing a watch) invalidates it
+    if cached and cached[0] == model:
+        return cached[1], cached[2]
     
-    # Dynamic categories from option_codes.py for this model
+    # Dynamic categories from option_codes.json for this model
     model_opts = OPTION_CODES_DATA.get(model, {})
-    
+    code_to_cat = CODE_TO_CATEGORY.get(model, {})
     # Fallback if empty (e.g. invalid model code)
     if not model_opts and 'my' in OPTION_CODES_DATA:
-         model_opts = OPTION_CODES_DATA['my']
+        model_opts, code_to_cat = OPTION_CODES_DATA['my'], CODE_TO_CATEGORY['my']
+    context.user_data['_model_opts'] = (model, model_opts, code_to_cat)
+    return model_opts, code_to_cat
+
+async def show_filter_categories(query, context):
+    # Show filters based on options
+    keyboard = []
+
+    model = context.user_data['watch_config'].get('model', 'my')
+    model_opts, _ = wizard_model_options(context)
          
     for cat in model_opts.keys():
         keyboard.append([InlineKeyboardButton(f"📂 {cat}", callback_data=f"cat_{cat}")])
@@ -573,11 +931,7 @@ async def filter_category_handler(update: Update, context: ContextTypes.DEFAULT_
         # Show options for this cat
         keyboard = []
 
-        model = context.user_data['watch_config'].get('model', 'my')
-        model_opts = OPTION_CODES_DATA.get(model, {})
-        # Fallback
-        if not model_opts and 'my' in OPTION_CODES_DATA: model_opts = OPTION_CODES_DATA['my']
-
+        model_opts, _ = wizard_model_options(context)
         codes_map = model_opts.get(cat, {})
 
         for c, name in codes_map.items():
@@ -600,16 +954,8 @@ async def filter_category_handler(update: Update, context: ContextTypes.DEFAULT_
         # Refresh current view (stay in category)
         # We need to find which category this code belongs to
         
-        # We need model context
-        model = context.user_data['watch_config'].get('model', 'my')
-        model_opts = OPTION_CODES_DATA.get(model, {})
-        if not model_opts and 'my' in OPTION_CODES_DATA: model_opts = OPTION_CODES_DATA['my']
-        
-        target_cat = "Other"
-        for cat, opts in model_opts.items():
-            if code in opts:
-                target_cat = cat
-                break
+        model_opts, code_to_cat = wizard_model_options(context)
+        target_cat = code_to_cat.get(code.lstrip('$'), "Other")
 
         # Re-render list
         keyboard = []
@@ -644,30 +990,20 @@ async def save_watch(query, context):
     
     if watch_id:
         # Update existing
-        user = await db.get_user(chat_id)
-        if user and 'watches' in user:
-            # Replace logic
-            new_watches = []
-            for w in user['watches']:
-                if w['id'] == watch_id:
-                    criteria['id'] = watch_id
-                    criteria['seen_vins'] = w.get('seen_vins', []) # Keep history
-                    
-                    # Ensure new fields (condition_mode) are saved
-                    criteria['condition'] = cfg.get('condition', 'new')
-                    criteria['condition_mode'] = cfg.get('condition_mode', 'all_new')
-                    
-                    new_watches.append(criteria)
-                else:
-                    new_watches.append(w)
-            await db.update_user(chat_id, {'watches': new_watches})
-            action = "Updated"
+        # Ensure new fields (condition_mode) are saved
+        criteria['condition'] = cfg.get('condition', 'new')
+        criteria['condition_mode'] = cfg.get('condition_mode', 'all_new')
+        
+        if not await db.replace_watch(chat_id, watch_id, criteria):
+            await query.edit_message_text("❌ Watch ID not found.")
+            return ConversationHandler.END
+        action = "Updated"
     else:
         # Create new
         watch_id = db.add_watch(chat_id, criteria)
         action = "Activated"
 
-    start_inventory_job(context.job_queue, chat_id)
+    start_inventory_job(context.application, chat_id)
     
     await query.edit_message_text(f"✅ **Watch {action}!**\nID: `{watch_id}`\nWe will notify you when a match is found.", parse_mode='Markdown')
     return ConversationHandler.END
@@ -684,7 +1020,7 @@ async def inv_check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Reusing job function but we need a mock job object context or just extract logic.
     # Easiest: extract logic to 'run_check_for_user(chat_id)'
     
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     db = context.bot_data['db']
     inv = context.bot_data['inventory']
     
@@ -696,35 +1032,34 @@ async def inv_check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     show_all = args and 'all' in args
     
     user = await db.get_user(chat_id)
-    watches = user.get('watches', [])
+    watches = list(user.get('watches', {}).values())
     if not watches:
         await update.message.reply_text("No watches to check.")
         return
 
     count_found = 0
-    for watch in watches:
-        results = await inv.check_inventory(watch)
+    seen_updates = {} # {watch_id: [vin, ...]}, written once after the loop
+    # Query every watch concurrently; identical searches still share the inventory cache
+    results_list = await asyncio.gather(*(inv.check_inventory(w) for w in watches))
+    for watch, results in zip(watches, results_list):
         matches = inv.find_matches(results, watch)
         
-        seen_vins = set(watch.get('seen_vins', []))
+        seen_vins = watch.get('seen_vins', {})
         
         if show_all:
              # Show all matches, but still update seen_vins logic
              new_matches = matches
         else:
-             new_matches = [m for m in matches if m.get('VIN') not in seen_vins]
+             new_matches = [m for m in matches if m.vin not in seen_vins]
         
         if new_matches:
             count_found += len(new_matches)
-            for car in new_matches:
-                msg = inv.format_car(car)
-                await update.message.reply_text(msg, parse_mode='Markdown')
-                seen_vins.add(car.get('VIN'))
+            await reply_batched(update.message, [inv.format_car(car) for car in new_matches], parse_mode='Markdown')
             
-            # Update seen vins (non-atomic but fine for manual trigger)
-            watch['seen_vins'] = list(seen_vins)
+            seen_updates[watch['id']] = [car.vin for car in new_matches]
             
-    await db.update_user(chat_id, {'watches': watches})
+    if seen_updates:
+        await db.update_watch_seen_vins(chat_id, seen_updates)
     await update.message.reply_text(f"✅ Check complete. Found {count_found} new matches.")
 
 @check_auth
@@ -736,17 +1071,11 @@ async def inv_edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     watch_id = args[0]
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     db: UserDatabase = context.bot_data['db']
     user = await db.get_user(chat_id)
     
-    target_watch = None
-    if user and 'watches' in user:
-        for w in user['watches']:
-            if w['id'] == watch_id:
-                target_watch = w
-                break
-                
+    target_watch = (user or {}).get('watches', {}).get(watch_id)
     if not target_watch:
         await update.message.reply_text("❌ Watch ID not found.")
         return
@@ -809,10 +1138,10 @@ async def legacy_inv_watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         # Add to DB
         db = context.bot_data['db']
-        chat_id = update.effective_chat.id
+        chat_id = str(update.effective_chat.id)
         watch_id = db.add_watch(chat_id, criteria)
         
-        start_inventory_job(context.job_queue, chat_id)
+        start_inventory_job(context.application, chat_id)
         
         await update.message.reply_text(f"✅ Watch added! ID: `{watch_id}`\nCriteria: {criteria}", parse_mode='Markdown')
         
@@ -823,16 +1152,16 @@ async def legacy_inv_watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @check_auth
 async def inv_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     db: UserDatabase = context.bot_data['db']
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     user = await db.get_user(chat_id)
-    watches = user.get('watches', [])
+    watches = user.get('watches', {})
     
     if not watches:
         await update.message.reply_text("You have no active watches.")
         return
         
     msg = "**👀 Active Watches:**\n"
-    for w in watches:
+    for w in watches.values():
         msg += f"🆔 `{w['id']}`: {w.get('model','my')} in {w.get('market','ES')} < {w.get('price','No Limit')}\n"
     
     msg += "\nTo remove: `/inv_del <id>`\nTo clear history: `/inv_clear <id>`"
@@ -847,7 +1176,7 @@ async def inv_del_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     watch_id = args[0]
     db: UserDatabase = context.bot_data['db']
-    success = db.remove_watch(update.effective_chat.id, watch_id)
+    success = db.remove_watch(str(update.effective_chat.id), watch_id)
     
     if success:
         await update.message.reply_text("🗑️ Watch deleted.")
@@ -862,233 +1191,339 @@ async def inv_clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     watch_id = args[0]
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     db: UserDatabase = context.bot_data['db']
-    user = await db.get_user(chat_id)
-    
-    found = False
-    if user and 'watches' in user:
-        for w in user['watches']:
-            if w['id'] == watch_id:
-                w['seen_vins'] = []
-                found = True
-                break
     
-    if found:
-        await db.update_user(chat_id, {'watches': user['watches']})
+    if await db.clear_watch_seen_vins(chat_id, watch_id):
         await update.message.reply_text(f"🧹 History cleared for watch `{watch_id}`.\nNext check will report all current matches as new.")
     else:
         await update.message.reply_text("❌ Watch ID not found.")
 
 # --- Background Inventory Job ---
 
-async def inventory_job(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = context.job.chat_id
-    db: UserDatabase = context.bot_data['db']
-    inv: InventoryManager = context.bot_data['inventory']
+async def inventory_job(app, chat_id):
+    db: UserDatabase = app.bot_data['db']
+    inv: InventoryManager = app.bot_data['inventory']
     
     user = await db.get_user(chat_id)
-    watches = user.get('watches', [])
+    watches = list(user.get('watches', {}).values())
     
     if not watches:
         return # No watches, do nothing
 
-    for watch in watches:
+    async def process_watch(watch):
         # 1. Fetch
         results = await inv.check_inventory(watch)
         
         # 2. Filter
         matches = inv.find_matches(results, watch)
         
-        # 3. Notify (Simple diff: we don't store seen VINs per watch yet, so this might spam if not careful)
-        # To avoid spam, we'll only notify if it's "fresh" (not in a local temp cache for this run? No, need persistent memory of seen VINs).
-        # IMPLEMENTATION SHORTCUT: For now, just send top 1 match if not seen before?
-        # Better: Store 'seen_vins' in the watch object in DB.
-        
-        seen_vins = set(watch.get('seen_vins', []))
-        new_matches = [m for m in matches if m.get('VIN') not in seen_vins]
+        # 3. Only report VINs this watch hasn't reported before
+        seen_vins = watch.get('seen_vins', {})
+        return [m for m in matches if m.vin not in seen_vins]
+
+    # All watches are checked concurrently; one failing doesn't stop the rest
+    outcomes = await asyncio.gather(*(process_watch(w) for w in watches), return_exceptions=True)
+    
+    seen_updates = {} # {watch_id: [vin, ...]}, written once after the loop
+    messages = []
+    for watch, new_matches in zip(watches, outcomes):
+        if isinstance(new_matches, Exception):
+            logger.error(f"Inventory check failed for watch {watch['id']} ({chat_id}): {new_matches}")
+            continue
         
         if new_matches:
-            for car in new_matches: # Limit to 3 notifications
-                msg = inv.format_car(car)
-                await context.bot.send_message(chat_id=chat_id, text=msg, parse_mode='Markdown')
-                seen_vins.add(car.get('VIN'))
-            
-            # Update seen vins
-            watch['seen_vins'] = list(seen_vins)
-            # This save needs to be done on the user object, not directly on db.save()
-            # The watch object is a copy from the user's watches list.
-            # We need to update the user's watches list in the db.
-            await db.update_user(chat_id, {'watches': watches}) # Update the entire watches list for the user
-
-def start_inventory_job(queue, chat_id):
+            messages.extend(inv.format_car(car) for car in new_matches)
+            seen_updates[watch['id']] = [car.vin for car in new_matches]
+    
+    # Inventory results carry no photos, so matches go out as a few long texts instead of one send per car
+    if messages:
+        await send_batched(partial(app.bot.send_message, chat_id), messages, parse_mode='Markdown')
+    
+    # One DB update per run, touching only the watches that had hits
+    if seen_updates:
+        await db.update_watch_seen_vins(chat_id, seen_updates)
+
+def start_inventory_job(app, chat_id):
     # Check if job exists
     name = f"inv_{chat_id}"
-    current_jobs = queue.get_jobs_by_name(name)
-    if not current_jobs:
+    scheduler = app.bot_data['scheduler']
+    if not scheduler.has_job(name):
         # Run every 2 hours (7200s)
-        queue.run_repeating(inventory_job, interval=7200, first=10, chat_id=chat_id, name=name)
+        scheduler.schedule(name, partial(inventory_job, app, chat_id), 7200, first_run_delay(name, 7200))
 
 # --- Main Status & Diffing Logic ---
 
-async def check_orders_task(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = context.job.chat_id
-    db = context.bot_data['db']
-    client = TeslaClient(chat_id, db)
+_EMPTY = MappingProxyType({})
+
+def _dig(d, *keys, default=None):
+    """Follow `keys` down nested dicts; `default` as soon as a level is missing, None or not a dict."""
+    for key in keys:
+        if not isinstance(d, dict):
+            return default
+        d = d.get(key)
+        if d is None:
+            return default
+    return d
+
+def blocking_steps(details):
+    """Names of the registration steps still open, listed under "Action Required"."""
+    steps = _dig(details, 'tasks', 'registration', 'tasks', default=())
+    return [s['name'] for s in steps if not s['complete'] and s['status'] != 'COMPLETE']
+
+def order_digest(order, details):
+    """
+    BLAKE2b-128 hex digest of the fields shown in an order update, open registration
+    steps included; all that orders_state keeps per order. Any change to one of them
+    triggers a notification.
+    """
+    fields = (
+        order.get('orderStatus'),
+        order.get('modelCode'),
+        order.get('vin'),
+        _dig(details, 'tasks', 'registration', 'orderDetails', 'reservationDate'),
+        _dig(details, 'tasks', 'scheduling', 'deliveryWindowDisplay'),
+        _dig(details, 'tasks', 'scheduling', 'apptDateTimeAddressStr'),
+        _dig(details, 'tasks', 'finalPayment', 'data', 'etaToDeliveryCenter'),
+        _dig(details, 'tasks', 'registration', 'orderDetails', 'vehicleRoutingLocation'),
+        blocking_steps(details),
+    )
+    return hashlib.blake2b(orjson.dumps(fields), digest_size=16).hexdigest()
+
+def legacy_state_matches(old, order, details):
+    """
+    Whether a pre-hash orders_state entry (full summary/details payloads, or a {vin, window}
+    dict) is unchanged by the old VIN/window rule, so upgrading doesn't notify every order.
+    """
+    if 'summary' in old:
+        old = {'vin': old['summary'].get('vin'), 'window': _dig(old['details'], 'tasks', 'scheduling', 'deliveryWindowDisplay')}
+    return old == {'vin': order.get('vin'), 'window': _dig(details, 'tasks', 'scheduling', 'deliveryWindowDisplay')}
+
+async def check_orders_task(app, chat_id):
+    db = app.bot_data['db']
+    client = get_client(app.bot_data, chat_id)
     
     try:
         user = await db.get_user(chat_id)
         if not user: return # Should not happen
 
         prev_map = user.get('orders_state', {})
-        curr_map = {}
         
         orders = await client.get_orders()
-        for order in orders:
+        details_list = await asyncio.gather(*(client.get_order_details(o['referenceNumber']) for o in orders), return_exceptions=True)
+        curr_map = {}
+        changed = [] # (order, details) for new orders and orders whose digest moved
+        for order, details in zip(orders, details_list):
             rn = order['referenceNumber']
-            details = await client.get_order_details(rn)
-            
-            curr_map[rn] = {'summary': order, 'details': details}
-            
-            # Diff
-            old_data = prev_map.get(rn)
-            notify = False
-            
-            if not old_data:
-                notify = True # New
+            if isinstance(details, Exception):
+                logger.warning(f"Details fetch failed for {rn} ({chat_id}): {details}")
+                # Carry the last known state so a transient failure doesn't read as a change
+                if rn in prev_map:
+                    curr_map[rn] = prev_map[rn]
+                continue
+            digest = order_digest(order, details)
+            old = prev_map.get(rn)
+            if isinstance(old, dict):
+                old = digest if legacy_state_matches(old, order, details) else None
+            if old == digest:
+                # Unchanged orders keep the stored digest object, so the saved state is mostly the old one
+                curr_map[rn] = old
             else:
-                if old_data['summary'].get('vin') != order.get('vin'): notify = True
-                if old_data['details']['tasks']['scheduling'].get('deliveryWindowDisplay') != details['tasks']['scheduling'].get('deliveryWindowDisplay'): notify = True
-                
-            if notify:
-                msg, url = format_full_message(order, details)
-                try:
-                    await context.bot.send_photo(chat_id, url, caption=msg, parse_mode='Markdown')
-                except:
-                    await context.bot.send_message(chat_id, msg, parse_mode='Markdown')
+                curr_map[rn] = digest
+                changed.append((order, details))
         
-        # Save state
-        await db.update_user(chat_id, {'orders_state': curr_map})
+        # Logged out while the fetches were in flight: don't notify, write or reschedule
+        if not db.is_authorized(chat_id):
+            return
+        
+        # Fast path: nothing changed since the last poll -> no diff, no DB write
+        orders_hash = hashlib.blake2b(orjson.dumps(curr_map, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        if orders_hash == user.get('orders_hash'):
+            await adapt_poll_interval(app, chat_id, user, changed=False)
+            return
+        
+        # (msg, url) per changed order, sent together below
+        updates = [format_full_message(order, details) for order, details in changed]
+        
+        if updates:
+            sent = await send_order_updates(app.bot, db, chat_id, updates)
+            # Only what didn't go out as photos is resent as text
+            for msg, _ in updates[sent:]:
+                await app.bot.send_message(chat_id, msg, parse_mode='Markdown')
+        
+        # Save state, unless a logout landed while the updates were being sent
+        if not db.is_authorized(chat_id):
+            return
+        await db.update_user(chat_id, {'orders_state': curr_map, 'orders_hash': orders_hash})
+        await adapt_poll_interval(app, chat_id, user, bool(updates))
         
     except Exception as e:
         logger.error(f"Job failed for {chat_id}: {e}")
 
+async def adapt_poll_interval(app, chat_id, user, changed):
+    """Back the poll interval off while orders are stable, snap back to the user's setting on change."""
+    if not app.bot_data['scheduler'].has_job(chat_id):
+        return # Removed (e.g. /logout) while this poll ran; don't bring it back
+    base = user.get('interval', 30) * 60
+    # Kept in memory, not in the user doc, so unchanged polls stay free of DB writes;
+    # a restart just starts the backoff over from the user's interval
+    stable_polls = app.bot_data['stable_polls']
+    # Exponent is capped: 1.5**20 takes even a 5 min base past MAX_POLL_INTERVAL
+    stable = stable_polls[chat_id] = 0 if changed else min(stable_polls.get(chat_id, 0) + 1, 20)
+    interval = int(max(base, min(base * POLL_BACKOFF ** stable, MAX_POLL_INTERVAL)))
+    
+    start_job(app, chat_id, interval, first=interval)
+
 @check_auth
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
+    chat_id = str(update.effective_chat.id)
     db = context.bot_data['db']
-    client = TeslaClient(chat_id, db)
+    client = get_client(context.bot_data, chat_id)
     
     await update.message.reply_text("🔄 Checking...")
     try:
         orders = await client.get_orders()
-        for order in orders:
-            details = await client.get_order_details(order['referenceNumber'])
+        details_list = await asyncio.gather(*(client.get_order_details(o['referenceNumber']) for o in orders), return_exceptions=True)
+        for order, details in zip(orders, details_list):
+            if isinstance(details, Exception):
+                logger.warning(f"Details fetch failed for {order['referenceNumber']} ({chat_id}): {details}")
+                await update.message.reply_text(f"⚠️ {order['referenceNumber']}: couldn't load order details ({details})")
+                continue
             msg, url = format_full_message(order, details)
             try:
-                await update.message.reply_photo(url, caption=msg, parse_mode='Markdown')
-            except:
+                await send_cached_photo(update.message.reply_photo, db, chat_id, url, caption=msg, parse_mode='Markdown')
+            except (BadRequest, httpx.HTTPError) as e:
+                logger.warning(f"Photo send failed for {chat_id}, falling back to text: {e}")
                 await update.message.reply_text(msg, parse_mode='Markdown')
     except Exception as e:
         await update.message.reply_text(f"❌ Error: {e}")
 
+_MSG_TEMPLATE = (
+    "🚗 **Tesla Order: {referenceNumber}**\n"
+    "**Status:** {orderStatus}\n"
+    "**Model:** {modelCode}\n\n"
+    "{vin_block}"
+    "\n📍 **Logistics**\n"
+    "• **Location:** {vehicleRoutingLocation}\n"
+    "• **ETA to Center:** {etaToDeliveryCenter}\n"
+    "• **Appointment:** {apptDateTimeAddressStr}\n"
+    "\n📅 **Dates**\n"
+    "• **Reserved:** {reservationDate}\n"
+    "• **Window:** {deliveryWindowDisplay}\n"
+)
+
 def format_full_message(order, details):
-    rn = order['referenceNumber']
-    status = order.get('orderStatus', 'Unknown')
-    model = order.get('modelCode', 'Unknown')
+    tasks = _dig(details, 'tasks', default=_EMPTY)
+    sched = _dig(tasks, 'scheduling', default=_EMPTY)
+    reg_details = _dig(tasks, 'registration', 'orderDetails', default=_EMPTY)
+    final_payment = _dig(tasks, 'finalPayment', 'data', default=_EMPTY)
+
     vin = order.get('vin')
-    
-    # Extract details
-    tasks = details.get('tasks', {})
-    sched = tasks.get('scheduling', {})
-    reg = tasks.get('registration', {})
-    reg_details = reg.get('orderDetails', {})
-    final_payment = tasks.get('finalPayment', {}).get('data', {})
-    
-    # Fields
-    reservation_date = reg_details.get('reservationDate', 'N/A')
-    delivery_window = sched.get('deliveryWindowDisplay', 'Pending')
-    routing_loc = reg_details.get('vehicleRoutingLocation', 'N/A')
-    eta_to_center = final_payment.get('etaToDeliveryCenter', 'N/A')
-    appt = sched.get('apptDateTimeAddressStr', 'Not Scheduled')
-    
-    # Build Message
-    msg = (
-        f"🚗 **Tesla Order: {rn}**\n"
-        f"**Status:** {status}\n"
-        f"**Model:** {model}\n\n"
-    )
-    
     if vin:
-        msg += f"✅ **VIN Assigned:** `{vin}`\n🏭 {decode_vin(vin)}\n"
+        vin_block = f"✅ **VIN Assigned:** `{vin}`\n🏭 {decode_vin(vin)}\n"
     else:
-        msg += "⛔ **VIN:** Not Assigned Yet\n"
-        
-    msg += (
-        f"\n📍 **Logistics**\n"
-        f"• **Location:** {routing_loc}\n"
-        f"• **ETA to Center:** {eta_to_center}\n"
-        f"• **Appointment:** {appt}\n"
-    )
-
-    msg += (
-        f"\n📅 **Dates**\n"
-        f"• **Reserved:** {reservation_date}\n"
-        f"• **Window:** {delivery_window}\n"
-    )
+        vin_block = "⛔ **VIN:** Not Assigned Yet\n"
+
+    # Each field read from the payload it belongs to, with its fallback text
+    fields = {
+        'referenceNumber': order['referenceNumber'],
+        'orderStatus': order.get('orderStatus', 'Unknown'),
+        'modelCode': order.get('modelCode', 'Unknown'),
+        'vin_block': vin_block,
+        'vehicleRoutingLocation': reg_details.get('vehicleRoutingLocation', 'N/A'),
+        'etaToDeliveryCenter': final_payment.get('etaToDeliveryCenter', 'N/A'),
+        'apptDateTimeAddressStr': sched.get('apptDateTimeAddressStr', 'Not Scheduled'),
+        'reservationDate': reg_details.get('reservationDate', 'N/A'),
+        'deliveryWindowDisplay': sched.get('deliveryWindowDisplay', 'Pending'),
+    }
+    msg = _MSG_TEMPLATE.format_map(fields)
     
     # Blocking steps
-    steps = reg.get('tasks', [])
-    blocking = [s['name'] for s in steps if not s['complete'] and s['status'] != 'COMPLETE']
+    blocking = blocking_steps(details)
     if blocking:
-        msg += "\n⚠️ **Action Required:**\n" + "\n".join([f"• {b}" for b in blocking[:3]])
+        msg += "\n⚠️ **Action Required:**\n" + "\n".join(f"• {b}" for b in blocking[:3])
         
-    return msg, get_image_url(order.get('optionCodeList', []), model)
+    return msg, get_image_url(order.get('optionCodeList', []), fields['modelCode'])
 
 # --- Infrastructure ---
 
-def start_job(job_queue, chat_id, interval_seconds):
-    # Remove existing
-    jobs = job_queue.get_jobs_by_name(str(chat_id))
-    for j in jobs: j.schedule_removal()
-    
-    job_queue.run_repeating(check_orders_task, interval=interval_seconds, first=10, chat_id=chat_id, name=str(chat_id))
+def first_run_delay(name, interval_seconds):
+    """Seconds until a job's first run, spread per job (stable for a given name) so restored jobs don't all fire together."""
+    return 10 + random.Random(name).uniform(0, min(interval_seconds, 300))
+
+def start_job(app, chat_id, interval_seconds, first=None):
+    # Replaces any existing orders job for this chat, unless it already runs at this interval
+    scheduler = app.bot_data['scheduler']
+    if scheduler.interval(chat_id) == interval_seconds:
+        return
+    if first is None:
+        first = first_run_delay(chat_id, interval_seconds)
+    scheduler.schedule(chat_id, partial(check_orders_task, app, chat_id), interval_seconds, first)
 
 async def post_init(application):
     db = application.bot_data['db']
-    asyncio.create_task(health_check_server())
+    db.start()
+    application.bot_data['scheduler'].start()
+    application.bot_data['health'] = await health_check_server()
     
     # Restore jobs
-    users = await db.get_all_users()
+    users = await db.get_all_users_full()
     logger.info(f"Restoring jobs for {len(users)} users...")
     
-    for uid in users:
-        u_data = await db.get_user(uid)
+    for uid, u_data in users:
         interval = u_data.get('interval', 30) * 60
-        start_job(application.job_queue, uid, interval)
+        start_job(application, uid, interval)
 
         # Restore inventory jobs
         if u_data.get('watches'):
-            start_inventory_job(application.job_queue, uid)
+            start_inventory_job(application, uid)
+
+async def post_shutdown(application):
+    health = application.bot_data['health']
+    health.close()
+    await health.wait_closed()
+    await application.bot_data['scheduler'].close()
+    await application.bot_data['inventory'].close()
+    await application.bot_data['db'].close()
+    await application.bot_data['http'].aclose()
 
+HEALTH_READ_TIMEOUT = 5  # seconds to receive a probe's request headers
+HEALTH_OK = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nOK'
+HEALTH_NOT_FOUND = b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
 
 async def health_check_server():
-    async def handle(r): return web.Response(text="OK")
-    app = web.Application()
-    app.add_routes([web.get('/health', handle)])
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 8080)
-    await site.start()
+    # Plain asyncio socket server; a full web framework is overkill for one static route
+    async def handle(reader, writer):
+        try:
+            # Bounded, so a client that never finishes its headers can't hold the socket open
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HEALTH_READ_TIMEOUT)
+            if request.startswith(b'GET /health '):
+                writer.write(HEALTH_OK)
+            else:
+                writer.write(HEALTH_NOT_FOUND)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, '0.0.0.0', 8080)
 
 if __name__ == '__main__':
+    # libuv-backed event loop: cheaper awaits across httpx, the health server and the bot dispatcher
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     # Initialize
     db = UserDatabase()
     inventory_manager = InventoryManager(db)
     
-    app = ApplicationBuilder().token(os.getenv('TELEGRAM_TOKEN')).post_init(post_init).build()
+    app = ApplicationBuilder().token(os.getenv('TELEGRAM_TOKEN')).post_init(post_init).post_shutdown(post_shutdown).build()
     app.bot_data['db'] = db
     app.bot_data['inventory'] = inventory_manager
+    app.bot_data['http'] = HTTP
+    app.bot_data['clients'] = {}
+    app.bot_data['stable_polls'] = {} # {chat_id: unchanged polls in a row}, drives the poll backoff
+    app.bot_data['scheduler'] = PollScheduler()
     
     # Handlers
     app.add_handler(CommandHandler('start', help_command))
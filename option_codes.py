@@ -1,157 +1,24 @@
-# Auto-generated Option Codes
+# Option Codes (data is auto-generated into option_codes.json by discover_options.py)
 # Structure: Model -> Category -> Code: Name
 
-OPTION_CODES_DATA = {
-  "my": {
-    "Autopilot": {
-      "$APBS": "Piloto automático"
-    },
-    "Interior": {
-      "$IBB3": "Interior totalmente en negro",
-      "$IPB6": "Interior totalmente en negro Premium",
-      "$IPB7": "Interior totalmente en negro Premium",
-      "$IPB8": "Interior totalmente en negro Premium",
-      "$IPW7": "Interior en blanco y negro Premium",
-      "$IPW8": "Interior en blanco y negro Premium",
-      "$STY5B": "Interior de cinco asientos",
-      "$STY5S": "Interior de cinco asientos"
-    },
-    "Other": {
-      "$CPF0": "Conectividad estándar",
-      "$CPF1": "Conectividad premium",
-      "$FM3U": "Mejora de aceleración",
-      "$MDLY": "Model Y",
-      "$MTY41": "Gran autonomía con tracción integral",
-      "$MTY47": "Gran autonomía con tracción integral",
-      "$MTY52": "Gran autonomía con tracción trasera",
-      "$MTY62": "Gran autonomía con tracción integral",
-      "$MTY66": "Model Y Gran autonomía con tracción trasera",
-      "$MTY68": "Standard con tracción trasera",
-      "$SC04": "Acceso a la red de Supercargador + pago en marcha",
-      "$TW01": "Bola de remolque"
-    },
-    "Paint": {
-      "$PBSB": "Negro Sólido",
-      "$PN00": "Plateado Mercurio",
-      "$PN01": "Gris Sigilo",
-      "$PPSW": "Blanco Perla Multicapas",
-      "$PR01": "Ultra Rojo",
-      "$PX02": "Negro diamante"
-    },
-    "Wheels": {
-      "$WY18P": "Llantas Aperture de 18\"",
-      "$WY19P": "Llantas Crossflow de 19\"",
-      "$WY20A": "Llantas Helix 2.0 de 20\""
-    }
-  },
-  "m3": {
-    "Autopilot": {
-      "$APBS": "Piloto automático"
-    },
-    "Interior": {
-      "$IPB2": "Negro",
-      "$IPB3": "Negro",
-      "$IPW3": "Negro y blanco"
-    },
-    "Other": {
-      "$CPF0": "Conectividad estándar",
-      "$CPF1": "Conectividad premium",
-      "$MDL3": "Model 3",
-      "$MT352": "Gran autonomía con tracción integral",
-      "$MT356": "Gran autonomía con tracción trasera",
-      "$MT362": "Model 3 Gran autonomía con tracción trasera",
-      "$MT369": "Model 3 Gran autonomía con tracción trasera",
-      "$SC04": "Acceso a la red de Supercargador + pago en marcha",
-      "$TW01": "Bola de remolque"
-    },
-    "Paint": {
-      "$PN00": "Plateado Mercurio",
-      "$PN01": "Gris Sigilo",
-      "$PPSB": "Azul Oscuro Metalizado",
-      "$PPSW": "Blanco Perla Multicapas",
-      "$PR01": "Ultra Rojo",
-      "$PX02": "Negro diamante"
-    },
-    "Wheels": {
-      "$W38A": "Llantas Photon de 18\"",
-      "$W39S": "Llantas Nova de 19\""
-    }
-  },
-  "ms": {
-    "Autopilot": {
-      "$APBS": "Piloto automático"
-    },
-    "Other": {
-      "$CPF2": "Conectividad premium gratis",
-      "$IBE00": "Interior negro premium con decoración de ébano",
-      "$IBE01": "Interior negro premium con decoración de ébano",
-      "$ICW01": "Interior en crema premium con decoración de madera de roble",
-      "$IWW00": "Interior blanco y negro premium con decoración en nogal",
-      "$MDLS": "Model S",
-      "$MTS18": "Tracción a las cuatro ruedas",
-      "$MTS22": "Model S Tracción a las cuatro ruedas",
-      "$SC05": "Carga gratuita en Supercharger",
-      "$ST06": "Volante",
-      "$TW01": "Capacidad de remolque"
-    },
-    "Paint": {
-      "$PN01": "Gris Sigilo",
-      "$PN02": "Plateado Lunar",
-      "$PPSW": "Blanco Perla Multicapas",
-      "$PR01": "Ultra Rojo",
-      "$PX02": "Negro diamante"
-    },
-    "Wheels": {
-      "$WS10": "Llantas Arachnid de 21\"",
-      "$WS13": "Llantas Velarium de 21\"",
-      "$WS90": "Llantas Tempest de 19\""
-    }
-  },
-  "mx": {
-    "Autopilot": {
-      "$APBS": "Piloto automático"
-    },
-    "Interior": {
-      "$CC01": "Interior de cinco asientos",
-      "$CC02": "Interior de seis asientos",
-      "$CC04": "Interior de siete asientos"
-    },
-    "Other": {
-      "$CPF2": "Conectividad premium gratis",
-      "$IBC00": "Interior totalmente en negro Premium con decoración de fibra de carbono",
-      "$IBE00": "Interior negro premium con decoración de ébano",
-      "$IBE01": "Interior negro premium con decoración de ébano",
-      "$ICW00": "Interior en crema premium con decoración de madera de roble",
-      "$ICW01": "Interior en crema premium con decoración de madera de roble",
-      "$IWC00": "Interior en negro y blanco Premium con decoración de fibra de carbono",
-      "$IWW00": "Interior blanco y negro premium con decoración en nogal",
-      "$IWW01": "Interior blanco y negro premium con decoración en nogal",
-      "$MDLX": "Model X",
-      "$MTX13": "Tracción a las cuatro ruedas",
-      "$MTX15": "Tracción a las cuatro ruedas",
-      "$MTX18": "Tracción a las cuatro ruedas",
-      "$MTX19": "Plaid",
-      "$MTX22": "Model X Tracción a las cuatro ruedas",
-      "$SC05": "Carga gratuita en Supercharger",
-      "$ST06": "Volante",
-      "$ST0Y": "Volante Yoke",
-      "$TW01": "Paquete de remolque"
-    },
-    "Paint": {
-      "$PBSB": "Negro Sólido",
-      "$PN01": "Gris Sigilo",
-      "$PN02": "Plateado Lunar",
-      "$PPSW": "Blanco Perla Multicapas",
-      "$PR01": "Ultra Rojo",
-      "$PX02": "Negro diamante"
-    },
-    "Wheels": {
-      "$WX00": "Llantas Cyberstream de 20\"",
-      "$WX01": "Llantas Cyberstream de 20\"",
-      "$WX02": "Llantas Perihelix de 20\"",
-      "$WX20": "Llantas Turbine de 22\"",
-      "$WX21": "Llantas Turbine de 22\"",
-      "$WX22": "Llantas Machina de 22\""
-    }
-  }
+import os
+from types import MappingProxyType
+
+import orjson
+
+OPTION_CODES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "option_codes.json")
+
+with open(OPTION_CODES_FILE, "rb") as f:
+    OPTION_CODES_DATA = orjson.loads(f.read())
+
+# Read-only from here on; the data is shared by every handler
+for _cats in OPTION_CODES_DATA.values():
+    for _category, _items in _cats.items():
+        _cats[_category] = MappingProxyType(_items)
+
+# Inverted index built once at import: Model -> code (without '$') -> category.
+# Per model, since nothing in the generated data stops two models filing a code differently
+CODE_TO_CATEGORY = {
+    model: {code.lstrip('$'): category for category, items in cats.items() for code in items}
+    for model, cats in OPTION_CODES_DATA.items()
 }
@@ -0,0 +1,98 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+import time
+
+logger = logging.getLogger(__name__)
+
+class _Job:
+    __slots__ = ('callback', 'interval')
+
+    def __init__(self, callback, interval):
+        self.callback = callback
+        self.interval = interval
+
+class PollScheduler:
+    """
+    Drives every repeating poll from a single task and one heap of due times,
+    instead of one timer per user. Polls that fall due together run as one batch.
+    """
+    def __init__(self, max_concurrency=None):
+        self._heap = [] # (due, seq, name, job); entries whose job was replaced or removed are skipped
+        self._jobs = {} # {name: _Job}, the live job per name
+        self._seq = itertools.count() # tie-breaker so equal due times never compare jobs
+        self._wake = asyncio.Event()
+        self._sem = asyncio.Semaphore(max_concurrency or int(os.getenv('POLL_MAX_CONCURRENCY', '32')))
+        self._batches = set() # running batch tasks, referenced so they aren't collected mid-flight
+        self._task = None
+
+    def start(self):
+        """Start the scheduler loop (needs a running event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._batches):
+            task.cancel()
+        # Let cancelled polls unwind before the caller closes what they use
+        await asyncio.gather(*self._batches, return_exceptions=True)
+
+    def schedule(self, name, callback, interval, first=10):
+        """(Re)schedule `callback()` every `interval` seconds, first run in `first` seconds."""
+        job = self._jobs[name] = _Job(callback, interval)
+        heapq.heappush(self._heap, (time.monotonic() + first, next(self._seq), name, job))
+        self._wake.set()
+
+    def remove(self, name):
+        # The heap entry stays behind and is dropped when it comes due
+        self._jobs.pop(name, None)
+
+    def has_job(self, name):
+        return name in self._jobs
+
+    def interval(self, name):
+        job = self._jobs.get(name)
+        return job.interval if job else None
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                _, _, name, job = heapq.heappop(self._heap)
+                if self._jobs.get(name) is not job:
+                    continue # removed or rescheduled since this entry was pushed
+                due.append((name, job))
+                heapq.heappush(self._heap, (now + job.interval, next(self._seq), name, job))
+
+            if due:
+                # Run the batch in the background so a slow poll doesn't hold up the next wakeup
+                task = asyncio.create_task(self._run_batch(due))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+
+            self._wake.clear()
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_batch(self, due):
+        await asyncio.gather(*(self._call(name, job) for name, job in due))
+
+    async def _call(self, name, job):
+        async with self._sem:
+            try:
+                await job.callback()
+            except Exception as e:
+                logger.error(f"Scheduled poll {name} failed: {e}")
@@ -1,5 +1,5 @@
 import httpx
-import json
+import orjson
 import asyncio
 
 async def test_inventory():
@@ -44,7 +44,7 @@ async def test_inventory():
     }
     
     params = {
-        "query": json.dumps(query_payload)
+        "query": orjson.dumps(query_payload).decode()
     }
     
     headers = {
@@ -70,8 +70,8 @@ async def test_inventory():
 
     print(f"--- Request ---")
     print(f"URL: {url}")
-    print(f"Params: {json.dumps(params, indent=2)}")
-    print(f"Headers: {json.dumps(headers, indent=2)}")
+    print(f"Params: {orjson.dumps(params, option=orjson.OPT_INDENT_2).decode()}")
+    print(f"Headers: {orjson.dumps(headers, option=orjson.OPT_INDENT_2).decode()}")
 
     # Use HTTP/2 to mimic browser
     async with httpx.AsyncClient(timeout=20.0, http2=True) as client:
@@ -80,7 +80,7 @@ async def test_inventory():
         print(f"Status: {resp.status_code}")
         
         if resp.status_code == 200:
-            data = resp.json()
+            data = orjson.loads(resp.content)
             total = data.get('total_matches_found')
             print(f"Total Matches: {total}")
             results = data.get('results', [])
@@ -1,4 +1,4 @@
-from inventory import InventoryManager
+from inventory import InventoryManager, Car
 
 # Mock DB
 class MockDB: pass
@@ -7,9 +7,9 @@ def test_filtering():
     inv = InventoryManager(MockDB())
     
     # Mock Cars
-    car_lr_1 = {"OptionCodeList": ["$MTY41", "$PPSW", "$WY19P", "$CPF0"], "VIN": "1"}
-    car_lr_2 = {"OptionCodeList": ["$MTY47", "$PBSB", "$WY20A", "$CPF0"], "VIN": "2"}
-    car_rwd = {"OptionCodeList": ["$MTY52", "$PPSW", "$WY19P", "$CPF0"], "VIN": "3"}
+    car_lr_1 = Car.from_result({"OptionCodeList": ["$MTY41", "$PPSW", "$WY19P", "$CPF0"], "VIN": "1"})
+    car_lr_2 = Car.from_result({"OptionCodeList": ["$MTY47", "$PBSB", "$WY20A", "$CPF0"], "VIN": "2"})
+    car_rwd = Car.from_result({"OptionCodeList": ["$MTY52", "$PPSW", "$WY19P", "$CPF0"], "VIN": "3"})
     
     results = [car_lr_1, car_lr_2, car_rwd]
     
@@ -18,7 +18,7 @@ def test_filtering():
     criteria = {"options": ["$MTY41", "$MTY47"]} 
     matches = inv.find_matches(results, criteria)
     print(f"Matches (Exp 2 cars): {len(matches)}")
-    for m in matches: print(f" - Found: {m['OptionCodeList']}")
+    for m in matches: print(f" - Found: {sorted(m.options)}")
     assert len(matches) == 2
     
     print("\n--- Test 2: Mixed OR (Paint) and AND (Trim) ---")
@@ -27,9 +27,9 @@ def test_filtering():
     criteria = {"options": ["$MTY41", "$PPSW", "$PBSB"]}
     matches = inv.find_matches(results, criteria)
     print(f"Matches (Exp 1 car - car_lr_1): {len(matches)}")
-    for m in matches: print(f" - Found: {m['OptionCodeList']}")
+    for m in matches: print(f" - Found: {sorted(m.options)}")
     assert len(matches) == 1
-    assert matches[0]['VIN'] == "1"
+    assert matches[0].vin == "1"
     
     print("\n--- Test 3: Standard AND (Other Option) ---")
     # MTY41 + CPF0
@@ -53,6 +53,15 @@ def test_filtering():
     print(f"Matches (Exp 0): {len(matches)}")
     assert len(matches) == 0
 
+    print("\n--- Test 6: Codes with and without '$' prefix ---")
+    # Criteria without '$' must match cars listing '$'-prefixed codes (and comma strings)
+    car_str = Car.from_result({"OptionCodeList": "$MTY62,$PPSW,$WY19P", "VIN": "4"})
+    criteria = {"options": ["MTY62", "$PPSW"]}
+    matches = inv.find_matches(results + [car_str], criteria)
+    print(f"Matches (Exp 1 car): {len(matches)}")
+    assert len(matches) == 1
+    assert matches[0].vin == "4"
+
     print("\n✅ All Tests Passed")
 
 if __name__ == "__main__":
@@ -0,0 +1,291 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from scheduler import PollScheduler
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'DB_FILE', str(tmp_path / 'users.db'))
+    monkeypatch.setattr(main, 'LEGACY_DB_FILE', str(tmp_path / 'users.json'))
+    db = main.UserDatabase()
+    yield db
+    db.conn.close()
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(kwargs.get('caption'))
+        return SimpleNamespace(photo=[])
+
+class FakeClient:
+    def __init__(self, orders, details, gate=None):
+        self.orders = orders
+        self.details = details
+        self.gate = gate
+
+    async def get_orders(self):
+        if self.gate is not None:
+            await self.gate.wait()
+        return self.orders
+
+    async def get_order_details(self, rn):
+        return self.details[rn]
+
+def make_app(db, client, chat_id):
+    scheduler = PollScheduler()
+    bot_data = {'db': db, 'scheduler': scheduler, 'clients': {chat_id: client}, 'stable_polls': {}}
+    return SimpleNamespace(bot=FakeBot(), bot_data=bot_data)
+
+ORDER = {'referenceNumber': 'RN1', 'vin': 'VIN1', 'orderStatus': 'BOOKED', 'modelCode': 'my'}
+DETAILS = {'tasks': {'scheduling': {'deliveryWindowDisplay': 'Oct 1 - Oct 15'}}}
+
+def test_logout_during_poll_does_not_resurrect_job(db):
+    async def run():
+        gate = asyncio.Event()
+        app = make_app(db, FakeClient([ORDER], {'RN1': DETAILS}, gate), '1')
+        await db.update_user('1', {'refresh_token': 'rt', 'interval': 30})
+        main.start_job(app, '1', 1800)
+
+        poll = asyncio.create_task(main.check_orders_task(app, '1'))
+        await asyncio.sleep(0)
+        # /logout while the poll waits on Tesla
+        await db.delete_user('1')
+        app.bot_data['scheduler'].remove('1')
+        gate.set()
+        await poll
+
+        assert await db.get_user('1') is None
+        assert not app.bot_data['scheduler'].has_job('1')
+        assert app.bot.sent == []
+    asyncio.run(run())
+
+def test_close_waits_for_in_flight_write(db, monkeypatch):
+    monkeypatch.setattr(main, 'DB_SAVE_DELAY', 0)
+    write_sync = db._write_sync
+    def slow_write(*batch):
+        time.sleep(0.2)
+        write_sync(*batch)
+    monkeypatch.setattr(db, '_write_sync', slow_write)
+
+    async def run():
+        db.start()
+        await db.update_user('1', {'refresh_token': 'rt'})
+        while db._flushing is None:
+            await asyncio.sleep(0.01)
+        # Shut down while the executor thread is still writing the batch
+        await db.close()
+    asyncio.run(run())
+
+    reloaded = main.UserDatabase()
+    assert reloaded.users == {'1': {'refresh_token': 'rt'}}
+    reloaded.conn.close()
+
+def test_unchanged_polls_back_off_without_db_writes(db, monkeypatch):
+    async def run():
+        app = make_app(db, FakeClient([ORDER], {'RN1': DETAILS}), '1')
+        await db.update_user('1', {'refresh_token': 'rt', 'interval': 30})
+        main.start_job(app, '1', 1800)
+        await main.check_orders_task(app, '1') # first poll stores the state
+
+        writes = []
+        monkeypatch.setattr(db, '_mark_dirty', lambda *a, **kw: writes.append(a))
+        await main.check_orders_task(app, '1')
+        await main.check_orders_task(app, '1')
+        assert writes == []
+        assert app.bot_data['stable_polls']['1'] == 2
+        assert app.bot_data['scheduler'].interval('1') == int(1800 * main.POLL_BACKOFF ** 2)
+    asyncio.run(run())
+
+def test_stale_cached_photo_is_dropped_and_reuploaded(db, monkeypatch):
+    async def fake_fetch(key, url):
+        return b'png'
+    monkeypatch.setattr(main, 'fetch_image', fake_fetch)
+    url = main.get_image_url(['$PPSW'], 'my')
+    key = main.hashlib.blake2b(url.encode()).hexdigest()
+    sent = []
+
+    async def send(photo, **kwargs):
+        if isinstance(photo, str):
+            raise main.BadRequest("Wrong file identifier/http url specified")
+        sent.append(photo)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id='fresh')])
+
+    async def run():
+        await db.update_user('1', {'refresh_token': 'rt', 'image_cache': {key: 'stale'}})
+        await main.send_cached_photo(send, db, '1', url, caption='hi')
+    asyncio.run(run())
+
+    assert len(sent) == 1
+    assert db.users['1']['image_cache'] == {key: 'fresh'}
+
+def test_failed_album_reports_how_many_updates_went_out(db, monkeypatch):
+    async def fake_fetch(key, url):
+        return b'png'
+    monkeypatch.setattr(main, 'fetch_image', fake_fetch)
+    albums = []
+
+    class AlbumBot(FakeBot):
+        async def send_media_group(self, chat_id, media):
+            if albums:
+                raise main.BadRequest("Too many requests")
+            albums.append([m.caption for m in media])
+            return [SimpleNamespace(photo=[]) for _ in media]
+
+    async def run():
+        await db.update_user('1', {'refresh_token': 'rt'})
+        updates = [(f'RN{i}', main.get_image_url(['$PPSW'], 'my')) for i in range(12)]
+        return await main.send_order_updates(AlbumBot(), db, '1', updates)
+    sent = asyncio.run(run())
+
+    # The first album went out; the caller resends only the failed second one as text
+    assert albums == [[f'RN{i}' for i in range(10)]]
+    assert sent == 10
+
+def test_load_moves_embedded_watches_to_their_table(db):
+    # A document from before the watches table, watch list and all
+    doc = {'refresh_token': 'rt', 'watches': [{'id': 'w1', 'model': 'my', 'seen_vins': ['A', 'B']}]}
+    with db.conn:
+        db.conn.execute("INSERT INTO users (chat_id, doc) VALUES (?, ?)", ('1', main.orjson.dumps(doc)))
+    db.conn.close()
+
+    loaded = main.UserDatabase()
+    watch = loaded.users['1']['watches']['w1']
+    assert watch['model'] == 'my'
+    assert list(watch['seen_vins']) == ['A', 'B']
+    user_doc, = loaded.conn.execute("SELECT doc FROM users WHERE chat_id = '1'").fetchone()
+    assert 'watches' not in main.orjson.loads(user_doc)
+    assert loaded.conn.execute("SELECT id FROM watches WHERE chat_id = '1'").fetchall() == [('w1',)]
+    loaded.conn.close()
+
+    # Reloading reads the watch back from its own table
+    reloaded = main.UserDatabase()
+    assert list(reloaded.users['1']['watches']['w1']['seen_vins']) == ['A', 'B']
+    reloaded.conn.close()
+
+def test_clear_watch_seen_vins_rewrites_only_that_watch(db, monkeypatch):
+    async def run():
+        await db.update_user('1', {'refresh_token': 'rt'})
+        w1 = db.add_watch('1', {'model': 'my'})
+        w2 = db.add_watch('1', {'model': 'm3'})
+        await db.update_watch_seen_vins('1', {w1: ['A'], w2: ['B']})
+
+        written = []
+        write_sync = db._write_sync
+        def record(*batch):
+            written.append(batch)
+            write_sync(*batch)
+        monkeypatch.setattr(db, '_write_sync', record)
+
+        assert await db.clear_watch_seen_vins('1', w1)
+        assert not await db.clear_watch_seen_vins('1', 'missing')
+        rows, deleted, watch_owners, watch_rows = written[0]
+        assert rows == [] and watch_owners == []
+        assert [wid for _, wid, _ in watch_rows] == [w1]
+        assert db.users['1']['watches'][w2]['seen_vins'] == {'B': None}
+    asyncio.run(run())
+
+def test_replace_watch_rewrites_only_that_watch(db, monkeypatch):
+    async def run():
+        await db.update_user('1', {'refresh_token': 'rt'})
+        w1 = db.add_watch('1', {'model': 'my'})
+        w2 = db.add_watch('1', {'model': 'm3'})
+        await db.update_watch_seen_vins('1', {w1: ['A']})
+
+        written = []
+        write_sync = db._write_sync
+        def record(*batch):
+            written.append(batch)
+            write_sync(*batch)
+        monkeypatch.setattr(db, '_write_sync', record)
+
+        assert await db.replace_watch('1', w1, {'model': 'mx'})
+        assert not await db.replace_watch('1', 'missing', {'model': 'mx'})
+        rows, deleted, watch_owners, watch_rows = written[0]
+        assert rows == [] and watch_owners == []
+        assert [wid for _, wid, _ in watch_rows] == [w1]
+        # Criteria replaced, id and history kept
+        assert db.users['1']['watches'][w1] == {'model': 'mx', 'id': w1, 'seen_vins': {'A': None}}
+        assert db.users['1']['watches'][w2]['model'] == 'm3'
+    asyncio.run(run())
+
+def test_full_message_reads_fields_from_their_own_payload():
+    # Same-named keys elsewhere in the order must not shadow the task payload's value
+    order = {**ORDER, 'deliveryWindowDisplay': 'stale', 'reservationDate': 'stale'}
+    details = {'tasks': {
+        'scheduling': {'deliveryWindowDisplay': 'Oct 1 - Oct 15'},
+        'registration': {'orderDetails': {'reservationDate': '2025-01-02'}},
+    }}
+    msg, _ = main.format_full_message(order, details)
+    assert '**Window:** Oct 1 - Oct 15' in msg
+    assert '**Reserved:** 2025-01-02' in msg
+    assert 'stale' not in msg
+    assert '**Appointment:** Not Scheduled' in main.format_full_message(ORDER, {})[0]
+
+def test_send_batched_splits_at_message_limit():
+    sent = []
+    async def send(text, **kwargs):
+        sent.append(text)
+    parts = [f"{i}:" + "x" * 1500 for i in range(7)]
+    asyncio.run(main.send_batched(send, parts))
+    assert all(len(text) <= main.MAX_MESSAGE_LEN for text in sent)
+    # Two 1.5k parts fit per message, three don't
+    assert len(sent) == 4
+    assert "\n\n".join(sent) == "\n\n".join(parts)
+
+def test_start_job_same_interval_is_a_noop(db):
+    async def run():
+        app = make_app(db, None, '1')
+        scheduler = app.bot_data['scheduler']
+        main.start_job(app, '1', 1800)
+        job = scheduler._jobs['1']
+        heap_size = len(scheduler._heap)
+
+        main.start_job(app, '1', 1800)
+        assert scheduler._jobs['1'] is job
+        assert len(scheduler._heap) == heap_size
+
+        main.start_job(app, '1', 600)
+        assert scheduler.interval('1') == 600
+    asyncio.run(run())
+
+def test_order_digest_tracks_blocking_steps():
+    step = {'name': 'Sign Agreement', 'complete': False, 'status': 'PENDING'}
+    pending = {'tasks': {'registration': {'tasks': [step]}}}
+    done = {'tasks': {'registration': {'tasks': [{**step, 'complete': True, 'status': 'COMPLETE'}]}}}
+    assert main.order_digest(ORDER, pending) != main.order_digest(ORDER, done)
+    assert main.order_digest(ORDER, done) == main.order_digest(ORDER, {'tasks': {}})
+
+def test_legacy_orders_state_does_not_notify_on_upgrade(db):
+    window = DETAILS['tasks']['scheduling']['deliveryWindowDisplay']
+    legacy_states = [
+        {'vin': 'VIN1', 'window': window},
+        {'summary': ORDER, 'details': DETAILS},
+    ]
+    for state in legacy_states:
+        async def run():
+            app = make_app(db, FakeClient([ORDER], {'RN1': DETAILS}), '1')
+            await db.update_user('1', {'refresh_token': 'rt', 'orders_state': {'RN1': state}, 'orders_hash': None})
+            main.start_job(app, '1', 1800)
+            await main.check_orders_task(app, '1')
+            return app
+        app = asyncio.run(run())
+        assert app.bot.sent == []
+        assert db.users['1']['orders_state'] == {'RN1': main.order_digest(ORDER, DETAILS)}
+
+    # A VIN that changed since the legacy state was written is still reported
+    async def run_changed():
+        app = make_app(db, FakeClient([ORDER], {'RN1': DETAILS}), '1')
+        await db.update_user('1', {'orders_state': {'RN1': {'vin': None, 'window': window}}, 'orders_hash': None})
+        main.start_job(app, '1', 1800)
+        await main.check_orders_task(app, '1')
+        return app
+    assert len(asyncio.run(run_changed()).bot.sent) == 1
@@ -0,0 +1,81 @@
+import asyncio
+
+from scheduler import PollScheduler
+
+def run_scheduler(setup, seconds):
+    """Start a scheduler, let `setup(scheduler)` add jobs, run it for `seconds`, then close it."""
+    async def run():
+        scheduler = PollScheduler()
+        scheduler.start()
+        await setup(scheduler)
+        await asyncio.sleep(seconds)
+        await scheduler.close()
+        return scheduler
+    return asyncio.run(run())
+
+def counter(calls, name):
+    async def callback():
+        calls.append(name)
+    return callback
+
+def test_due_jobs_run_and_reschedule():
+    calls = []
+    async def setup(scheduler):
+        scheduler.schedule('a', counter(calls, 'a'), 0.05, first=0)
+        scheduler.schedule('b', counter(calls, 'b'), 10, first=0)
+    scheduler = run_scheduler(setup, 0.22)
+    # 'a' runs at once and every 50ms after; 'b' only once
+    assert calls.count('a') >= 3
+    assert calls.count('b') == 1
+    assert scheduler.interval('a') == 0.05
+
+def test_removed_job_stops_running():
+    calls = []
+    ran_before_remove = []
+    async def setup(scheduler):
+        scheduler.schedule('a', counter(calls, 'a'), 0.05, first=0)
+        await asyncio.sleep(0.07)
+        scheduler.remove('a')
+        ran_before_remove.append(len(calls))
+    scheduler = run_scheduler(setup, 0.15)
+    assert not scheduler.has_job('a')
+    assert scheduler.interval('a') is None
+    assert ran_before_remove[0] >= 1
+    assert len(calls) == ran_before_remove[0]
+
+def test_reschedule_replaces_previous_job():
+    calls = []
+    async def setup(scheduler):
+        scheduler.schedule('a', counter(calls, 'old'), 0.05, first=0.05)
+        scheduler.schedule('a', counter(calls, 'new'), 10, first=0)
+    run_scheduler(setup, 0.15)
+    # The first entry is still in the heap but must be skipped
+    assert calls == ['new']
+
+def test_failing_job_keeps_its_schedule():
+    calls = []
+    async def boom():
+        calls.append('boom')
+        raise RuntimeError("poll failed")
+    async def setup(scheduler):
+        scheduler.schedule('a', boom, 0.05, first=0)
+    scheduler = run_scheduler(setup, 0.12)
+    assert len(calls) >= 2
+    assert scheduler.has_job('a')
+
+def test_close_waits_for_running_polls():
+    unwound = []
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            unwound.append(True)
+    async def run():
+        scheduler = PollScheduler()
+        scheduler.start()
+        scheduler.schedule('a', slow, 10, first=0)
+        await asyncio.sleep(0.05)
+        await scheduler.close()
+        # The poll has finished unwinding by the time close() returns
+        assert unwound == [True]
+    asyncio.run(run())